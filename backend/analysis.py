@@ -0,0 +1,315 @@
+import base64
+import hashlib
+import io
+from functools import partial
+import numpy as np
+import orjson
+import pandas as pd
+import wordcloud as wordcloud_lib
+import helper
+import metrics
+from engine import AnalysisEngine, STAGES
+
+
+# Pixel sizes the wordcloud image endpoint renders (square images)
+WORDCLOUD_SIZES = (250, 500, 1000)
+
+# Same limit WordCloud applies when drawing
+WORDCLOUD_MAX_WORDS = 200
+
+# Part of every wordcloud image's ETag; bump it when the rendering changes
+WORDCLOUD_RENDERER = f"wordcloud-{wordcloud_lib.__version__}-{helper.WORDCLOUD_RANDOM_STATE}-1"
+
+
+# Sections are written with orjson; NumPy arrays are encoded natively and
+# pandas objects are handed to _default
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+class Pivot:
+    # A table keyed by both its rows and its columns (the activity heatmap).
+    # Encoded like DataFrame.to_dict(), {column: {row: value}}, or in
+    # columnar form as its row labels, column labels and a matrix of values.
+
+    def __init__(self, frame):
+        self.frame = frame
+
+
+def _column(values, columnar):
+    # A frame column as something orjson writes without a callback: NumPy
+    # arrays in columnar form (orjson only takes C-contiguous ones, without
+    # NaT), lists otherwise
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object).tolist()
+    array = values.to_numpy()
+    if array.dtype.kind == 'M':
+        if columnar and not np.isnat(array).any():
+            return np.ascontiguousarray(array)
+        return array.astype('datetime64[us]').tolist()
+    if columnar and array.dtype.kind in 'biuf':
+        return np.ascontiguousarray(array)
+    return array.tolist()
+
+
+def _frame(frame, columnar):
+    # Records like DataFrame.to_dict(orient="records"), or one array per column
+    keys = [str(column) for column in frame.columns]
+    columns = [_column(frame.iloc[:, i], columnar) for i in range(frame.shape[1])]
+    if columnar:
+        return dict(zip(keys, columns))
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
+
+def _pivot(frame, columnar):
+    if columnar:
+        return {
+            "index": frame.index.tolist(),
+            "columns": [str(column) for column in frame.columns],
+            "values": np.ascontiguousarray(frame.to_numpy()),
+        }
+    index = frame.index.tolist()
+    return {str(column): dict(zip(index, frame[column].tolist())) for column in frame.columns}
+
+
+def _default(obj, columnar=False):
+    if isinstance(obj, pd.DataFrame):
+        return _frame(obj, columnar)
+    if isinstance(obj, pd.Series):
+        return dict(zip(obj.index.tolist(), obj.tolist()))
+    if isinstance(obj, Pivot):
+        return _pivot(obj.frame, columnar)
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def encode_section(data, columnar=False):
+    # Frames become records (or arrays per column when columnar is set)
+    return orjson.dumps(data, default=partial(_default, columnar=columnar), option=JSON_OPTIONS)
+
+
+def json_object(items):
+    # A JSON object from (key, already encoded value) pairs
+    return b"{" + b",".join(orjson.dumps(key) + b":" + value for key, value in items) + b"}"
+
+
+def stats(engine: AnalysisEngine, selected_user: str):
+    num_messages, words, num_media, num_links = engine.fetch_stats(selected_user)
+    return {
+        "num_messages": num_messages,
+        "num_words": words,
+        "num_media": num_media,
+        "num_links": num_links
+    }
+
+
+def busiest_users(engine: AnalysisEngine, selected_user: str):
+    x, busy_users_df = engine.most_busy_users()
+    return {
+        "top_users": x,
+        "percentages": busy_users_df
+    }
+
+
+def stop_word_config(extra_stop_words=None):
+    # Extra stop words in a canonical order, so they can be part of a cache key
+    return tuple(sorted(helper.stop_word_set(extra_stop_words) - helper.STOP_WORDS))
+
+
+def wordcloud_png(engine: AnalysisEngine, selected_user: str, size=500, stop_words=()):
+    with metrics.span("wordcloud_render"):
+        df_wc = engine.create_wordcloud(selected_user, helper.STOP_WORDS | set(stop_words), size)
+        img_buffer = io.BytesIO()
+        df_wc.to_image().save(img_buffer, format='PNG')
+        return img_buffer.getvalue()
+
+
+def wordcloud_etag(chat_id: str, selected_user: str, size: int, stop_words=()):
+    # Hash of everything the image depends on: the chat (its id is a content
+    # hash), the user, the size, every stop word in effect and the renderer
+    config = (chat_id, selected_user, size, sorted(helper.STOP_WORDS | set(stop_words)), WORDCLOUD_RENDERER)
+    return '"' + hashlib.sha256(repr(config).encode()).hexdigest()[:32] + '"'
+
+
+def wordcloud(engine: AnalysisEngine, selected_user: str):
+    # None when there are no words to draw (no text messages, or no such user)
+    if not helper.cloud_frequencies(engine.word_counts(selected_user)):
+        return None
+    wordcloud_img = base64.b64encode(wordcloud_png(engine, selected_user)).decode()
+    return f"data:image/png;base64,{wordcloud_img}"
+
+
+def wordcloud_words(engine: AnalysisEngine, selected_user: str):
+    # The words the cloud would be drawn from, for rendering it client side
+    counts = helper.cloud_frequencies(engine.word_counts(selected_user))
+    return [{"text": word, "value": count} for word, count in counts.most_common(WORDCLOUD_MAX_WORDS)]
+
+
+def links(engine: AnalysisEngine, selected_user: str):
+    domains, users = engine.links_shared(selected_user)
+    return {
+        "domains": domains,
+        "users": users
+    }
+
+
+def emojis(engine: AnalysisEngine, selected_user: str):
+    return engine.emoji_helper(selected_user)
+
+
+def timeline(engine: AnalysisEngine, selected_user: str):
+    return engine.monthly_timeline(selected_user)
+
+
+def activity_map(engine: AnalysisEngine, selected_user: str):
+    return {
+        "busy_day": engine.week_activity_map(selected_user),
+        "busy_month": engine.month_activity_map(selected_user)
+    }
+
+
+def daily_timeline(engine: AnalysisEngine, selected_user: str):
+    return engine.daily_timeline(selected_user)
+
+
+def activity_heatmap(engine: AnalysisEngine, selected_user: str):
+    # Heatmap returns a pivot table (DataFrame) encoded as {period: {day: count}}
+    return Pivot(engine.activity_heatmap(selected_user))
+
+
+def sentiment(engine: AnalysisEngine, selected_user: str):
+    sentiment_counts, sentiment_samples = engine.sentiment_analysis(selected_user)
+    return {
+        "counts": sentiment_counts,
+        "samples": sentiment_samples
+    }
+
+
+def user_detailed_stats(engine: AnalysisEngine, selected_user: str):
+    # This table only makes sense for the 'Overall' view
+    if selected_user != 'Overall':
+        return []
+    # Users who never replied to anyone have no median response time (null)
+    return engine.user_detailed_stats()
+
+
+def extra_stats(engine: AnalysisEngine, selected_user: str):
+    deleted_count, empty_messages, avg_msg_len, max_msg_len, avg_word_count, max_word_count = engine.extra_stats(selected_user)
+    return {
+        "deleted_messages": deleted_count,
+        "empty_messages": empty_messages,
+        "avg_msg_length": avg_msg_len,
+        "max_msg_length": max_msg_len,
+        "avg_word_count": avg_word_count,
+        "max_word_count": max_word_count
+    }
+
+
+# Response sections in the order /analyze returns them
+SECTIONS = {
+    "stats": stats,
+    "busiest_users": busiest_users,
+    "wordcloud": wordcloud,
+    "wordcloud_words": wordcloud_words,
+    "emojis": emojis,
+    "timeline": timeline,
+    "activity_map": activity_map,
+    "daily_timeline": daily_timeline,
+    "activity_heatmap": activity_heatmap,
+    "sentiment": sentiment,
+    "user_detailed_stats": user_detailed_stats,
+    "extra_stats": extra_stats,
+    "links": links,
+}
+
+
+# Engine stages each section reads; sections not listed only need the parsed frame
+SECTION_STAGES = {
+    "stats": ("words", "links"),
+    "wordcloud": ("tokens",),
+    "wordcloud_words": ("tokens",),
+    "emojis": ("emojis",),
+    "links": ("links",),
+    "sentiment": ("sentiment",),
+    "user_detailed_stats": ("words", "emojis"),
+    "extra_stats": ("words",),
+}
+
+
+# Order sections are streamed in: the ones computed straight from the parsed
+# frame first, then roughly by the cost of the engine stages they need
+STREAM_ORDER = [
+    "busiest_users", "timeline", "activity_map", "daily_timeline", "activity_heatmap",
+    "extra_stats", "user_detailed_stats", "emojis", "stats", "links",
+    "wordcloud_words", "wordcloud", "sentiment",
+]
+
+
+def stream_order(sections):
+    return sorted(sections, key=STREAM_ORDER.index)
+
+
+def parse_sections(sections):
+    # Comma separated section names; None or empty means every section
+    if not sections:
+        return list(SECTIONS)
+    requested = [section.strip() for section in sections.split(",") if section.strip()]
+    unknown = [section for section in requested if section not in SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown sections: {', '.join(unknown)}")
+    return requested
+
+
+def plan_stages(sections):
+    needed = set()
+    for section in sections:
+        needed.update(SECTION_STAGES.get(section, ()))
+    return [stage for stage in STAGES if stage in needed]
+
+
+def build_section(engine: AnalysisEngine, section: str, selected_user: str, columnar=False):
+    with metrics.span("section." + section):
+        data = SECTIONS[section](engine, selected_user)
+    with metrics.span("encode." + section):
+        return encode_section(data, columnar)
+
+
+def build_analysis(engine: AnalysisEngine, selected_user: str, sections=None, cached=None, columnar=False):
+    # Encoded JSON of the requested sections, reusing any already in
+    # `cached`; the engine stages they need run together in one pass
+    sections = list(SECTIONS) if sections is None else sections
+    cached = cached or {}
+    missing = [section for section in sections if section not in cached]
+    engine.prepare(plan_stages(missing))
+
+    encoded = {}
+    for section in SECTIONS:
+        if section not in sections:
+            continue
+        if section in cached:
+            encoded[section] = cached[section]
+        else:
+            encoded[section] = build_section(engine, section, selected_user, columnar)
+    return encoded
+
+
+def analysis_json(engine: AnalysisEngine, encoded):
+    # The /analyze response around already encoded sections
+    skipped = [section for section in SECTIONS if section not in encoded]
+    return json_object([
+        ("date_format", orjson.dumps(engine.df.attrs.get("date_format"))),
+        *encoded.items(),
+        ("skipped_sections", orjson.dumps(skipped)),
+    ])
+
+
+def chat_users(engine: AnalysisEngine):
+    # Users for the selection dropdown, 'Overall' first
+    user_list = [user for user in engine.rows if user != 'group_notification']
+    user_list.sort()
+    user_list.insert(0, "Overall")
+    return user_list
@@ -1,5 +1,6 @@
 from flask import Flask, render_template, request
 import preprocessing, helper
+from cache import open_export, read_blocks
 import matplotlib.pyplot as plt
 import os
 
@@ -9,8 +10,8 @@ app = Flask(__name__)
 def index():
     if request.method == "POST":
         file = request.files["chatfile"]
-        data = file.read().decode("utf-8")
-        df = preprocessing.preprocess(data)
+        # .txt, .zip export or .gz, decompressed and decoded block by block
+        df = preprocessing.preprocess(preprocessing.decode_chunks(read_blocks(open_export(file.stream))))
 
         users = df['user'].unique().tolist()
         users.remove("group_notification")
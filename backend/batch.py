@@ -0,0 +1,260 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import orjson
+import pandas as pd
+import analysis
+import preprocessing
+from cache import _chat_member, open_export, read_blocks
+from engine import AnalysisEngine
+
+# Batch mode: analyses every chat export in a directory or zip archive on a
+# pool of worker processes, e.g.
+#
+#   python batch.py exports/ results/ --workers 8
+#
+# Exports are .txt or gzipped .txt.gz files, or .zip files holding one chat
+# each, like WhatsApp's own "export chat" archives. A zip given as the source
+# is an archive of such exports, each of its members a chat of its own. Each
+# chat's analysis goes to results/chats/<name>.json, the same document
+# /analyze returns. One row per chat goes to results/summary.{parquet,json},
+# and one row per user of each chat to results/users.{parquet,json}. Finished chats are recorded in
+# results/progress.jsonl, so running the same command again after an
+# interruption only analyses the chats that are new, changed or failed.
+
+# Worker processes; each one analyses a whole chat at a time
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+
+# Sections written for each chat unless --sections is given. The base64
+# wordcloud image is left out; the words it is drawn from are kept.
+BATCH_SECTIONS = [section for section in analysis.SECTIONS if section != "wordcloud"]
+
+PROGRESS_FILE = "progress.jsonl"
+
+
+def find_chats(source):
+    # (name, location, fingerprint) of every export under `source`, in name
+    # order. A location is a file path or an (archive, member) pair; the
+    # fingerprint changes whenever the export does, without reading it.
+    if zipfile.is_zipfile(source):
+        yield from _source_archive_chats(source)
+        return
+
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            name = os.path.relpath(path, source).replace(os.sep, "/")
+            if file.lower().endswith((".txt", ".txt.gz")):
+                stat = os.stat(path)
+                yield name, path, [stat.st_size, stat.st_mtime_ns]
+            elif file.lower().endswith(".zip") and zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path) as zf:
+                    info = _export_chat(zf)
+                if info is not None:
+                    yield name + "/" + info.filename, (path, info.filename), [info.file_size, info.CRC]
+
+
+def _source_archive_chats(archive):
+    # A zip given as the source is an archive of exports: each .txt or
+    # .txt.gz member is a chat, and so is each .zip member, an export of its
+    # own whose chat is picked when it is read (see open_export)
+    with zipfile.ZipFile(archive) as zf:
+        for info in sorted(zf.infolist(), key=lambda info: info.filename):
+            member = info.filename
+            if info.is_dir():
+                continue
+            if member.lower().endswith((".txt", ".txt.gz")):
+                yield member, (archive, member), [info.file_size, info.CRC]
+            elif member.lower().endswith(".zip"):
+                try:
+                    with zf.open(info) as f, zipfile.ZipFile(f) as export:
+                        chat = _export_chat(export)
+                except zipfile.BadZipFile:
+                    continue
+                if chat is not None:
+                    yield member + "/" + chat.filename, (archive, member), [info.file_size, info.CRC]
+
+
+def _export_chat(zf):
+    # The chat member of one export archive; its other .txt members are
+    # attachments. None for archives that are not exports.
+    try:
+        return _chat_member(zf)
+    except ValueError:
+        return None
+
+
+def output_name(name):
+    # File name for a chat's outputs; the hash keeps names that only differ
+    # in punctuation apart
+    slug = re.sub(r"[^\w.-]+", "_", name).strip("_")[-100:]
+    return f"{slug}-{hashlib.sha256(name.encode()).hexdigest()[:8]}"
+
+
+def _hashed(blocks, digest):
+    for block in blocks:
+        digest.update(block)
+        yield block
+
+
+def _write(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def analyse_chat(name, location, output_dir, sections, date_format=None, messages=False):
+    # Runs in a worker process. Parses one export in blocks, writes its
+    # analysis and returns its summary row and per-user rows.
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    if isinstance(location, str):
+        with open(location, "rb") as f:
+            df = preprocessing.preprocess(preprocessing.decode_chunks(_hashed(read_blocks(open_export(f)), digest)), date_format)
+    else:
+        archive, member = location
+        with zipfile.ZipFile(archive) as zf, zf.open(member) as f:
+            df = preprocessing.preprocess(preprocessing.decode_chunks(_hashed(read_blocks(open_export(f)), digest)), date_format)
+
+    engine = AnalysisEngine(df)
+    base = os.path.join(output_dir, "chats", output_name(name))
+    _write(base + ".json", analysis.analysis_json(engine, analysis.build_analysis(engine, "Overall", sections)))
+    if messages:
+        df.to_parquet(base + ".parquet", index=False)
+
+    num_messages, words, media, links = engine.fetch_stats("Overall")
+    deleted = engine.extra_stats("Overall")[0]
+    dates = df["date"].dropna()
+    summary = {
+        "chat": name,
+        "sha256": digest.hexdigest(),
+        "output": os.path.relpath(base + ".json", output_dir),
+        "date_format": df.attrs.get("date_format"),
+        "users": len(analysis.chat_users(engine)) - 1,
+        "messages": num_messages,
+        "words": words,
+        "media": media,
+        "links": links,
+        "deleted": deleted,
+        "first_message": dates.min() if len(dates) else None,
+        "last_message": dates.max() if len(dates) else None,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    users = engine.user_detailed_stats()
+    users.insert(0, "Chat", name)
+    # Plain JSON values, as they are kept in the progress file
+    return orjson.loads(analysis.encode_section(summary)), orjson.loads(analysis.encode_section(users))
+
+
+def read_progress(output_dir):
+    # Latest progress entry per chat name; a line cut short by an
+    # interruption is ignored
+    entries = {}
+    path = os.path.join(output_dir, PROGRESS_FILE)
+    if not os.path.exists(path):
+        return entries
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            entries[entry["chat"]] = entry
+    return entries
+
+
+def _is_done(entry, fingerprint, output_dir):
+    return (
+        entry is not None
+        and entry["status"] == "done"
+        and entry["fingerprint"] == fingerprint
+        and os.path.exists(os.path.join(output_dir, entry["summary"]["output"]))
+    )
+
+
+def write_tables(output_dir, entries):
+    # Combined tables of every finished chat, rebuilt from the progress file
+    done = [entry for entry in entries if entry["status"] == "done"]
+    summary = pd.DataFrame([entry["summary"] for entry in done], columns=[
+        "chat", "sha256", "output", "date_format", "users", "messages", "words", "media",
+        "links", "deleted", "first_message", "last_message", "seconds",
+    ])
+    users = pd.DataFrame([user for entry in done for user in entry["users"]])
+    for table, columns in ((summary, ["first_message", "last_message"]), (users, ["First Seen", "Last Seen"])):
+        for column in columns:
+            if column in table:
+                table[column] = pd.to_datetime(table[column])
+
+    for name, table in (("summary", summary), ("users", users)):
+        table.to_parquet(os.path.join(output_dir, name + ".parquet"), index=False)
+        _write(os.path.join(output_dir, name + ".json"), analysis.encode_section(table))
+
+
+def run_batch(source, output_dir, workers=BATCH_WORKERS, sections=None, date_format=None, messages=False, log=sys.stderr):
+    # Returns the number of chats that failed
+    sections = BATCH_SECTIONS if sections is None else sections
+    os.makedirs(os.path.join(output_dir, "chats"), exist_ok=True)
+    chats = list(find_chats(source))
+    progress = read_progress(output_dir)
+    pending = [chat for chat in chats if not _is_done(progress.get(chat[0]), chat[2], output_dir)]
+    print(f"{len(chats)} chats, {len(chats) - len(pending)} already done", file=log)
+
+    failed = 0
+    if pending:
+        # Largest first, so one big chat does not hold up the end of the run
+        pending.sort(key=lambda chat: chat[2][0], reverse=True)
+        with open(os.path.join(output_dir, PROGRESS_FILE), "ab") as progress_file, \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(analyse_chat, name, location, output_dir, sections, date_format, messages): (name, fingerprint)
+                for name, location, fingerprint in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                name, fingerprint = futures[future]
+                entry = {"chat": name, "fingerprint": fingerprint}
+                try:
+                    summary, users = future.result()
+                    entry.update(status="done", summary=summary, users=users)
+                    message = f"{summary['messages']} messages in {summary['seconds']}s"
+                except Exception as e:
+                    failed += 1
+                    entry.update(status="failed", error=str(e) or type(e).__name__)
+                    message = f"failed: {entry['error']}"
+                progress_file.write(orjson.dumps(entry) + b"\n")
+                progress_file.flush()
+                progress[name] = entry
+                print(f"[{done}/{len(pending)}] {name}: {message}", file=log)
+
+    write_tables(output_dir, [progress[name] for name, _, _ in chats if name in progress])
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse every WhatsApp chat export in a directory or zip archive.")
+    parser.add_argument("source", help="directory or .zip archive of exported chats")
+    parser.add_argument("output", help="directory the results are written to")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="worker processes (default: %(default)s)")
+    parser.add_argument("--sections", help="comma separated sections to write (default: all but the wordcloud image)")
+    parser.add_argument("--date-format", help="strptime format of the message timestamps (default: detected)")
+    parser.add_argument("--messages", action="store_true", help="also write each chat's parsed messages as Parquet")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+    try:
+        sections = analysis.parse_sections(args.sections) if args.sections else None
+    except ValueError as e:
+        parser.error(str(e))
+    failed = run_batch(args.source, args.output, args.workers, sections, args.date_format, args.messages)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
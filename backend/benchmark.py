@@ -0,0 +1,297 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import analysis
+import preprocessing
+from engine import AnalysisEngine, STAGES
+
+# Benchmarks for parsing and analysis on synthetic chat exports, e.g.
+#
+#   python benchmark.py generate chat.txt --messages 10000000 --style ios
+#   python benchmark.py run --sizes 10000,100000,1000000 --save-baseline
+#   python benchmark.py run --sizes 10000,100000,1000000
+#
+# `run` times every stage of the pipeline at each size (best of --repeat
+# runs), then runs it once more under tracemalloc for each stage's peak
+# memory. With a saved baseline, stages that got slower than the threshold
+# allows are reported and the command exits with status 1.
+
+# Timestamp headers of the three export dialects preprocessing.patterns knows
+STYLES = {
+    "android12": lambda t: f"{t.day}/{t.month}/{t.year % 100:02d}, {t.hour % 12 or 12}:{t.minute:02d} {'am' if t.hour < 12 else 'pm'} - ",
+    "android24": lambda t: f"{t.day:02d}/{t.month:02d}/{t.year}, {t.hour:02d}:{t.minute:02d} - ",
+    "ios": lambda t: f"[{t.day:02d}/{t.month:02d}/{t.year}, {t.hour:02d}:{t.minute:02d}:{t.second:02d}] ",
+}
+
+WORDS = (
+    "the a is and to in it you that of for on this we so but not just like what when "
+    "meeting tomorrow today tonight lunch dinner coffee work home office call later soon "
+    "okay sure thanks great good nice cool awesome perfect done yes no maybe please sorry "
+    "project deadline report slides budget client team review update plan idea question "
+    "weekend holiday trip flight train weather rain match game movie music photo video"
+).split()
+EMOJIS = ["😂", "❤️", "👍🏽", "🙏", "🎉", "🔥", "😅", "🇵🇰", "🇬🇧", "👨‍👩‍👧", "1️⃣", "🤦🏻‍♂️"]
+DOMAINS = ["example.com", "www.youtube.com", "docs.google.com", "github.com", "news.ycombinator.com", "maps.app.goo.gl"]
+FIRST_NAMES = ["Alice", "Bob", "Chloé", "Dmitri", "Emeka", "Fatima", "Giulia", "Hiro", "Ines", "José", "Kwame", "Lena", "Mei", "Noah", "Olga", "Priya"]
+LAST_NAMES = ["Smith", "Khan", "García", "Müller", "Okafor", "Rossi", "Sato", "Novak"]
+
+# Share of each kind of message
+KINDS = [("text", 0.50), ("reply", 0.12), ("multiline", 0.08), ("emoji", 0.12), ("url", 0.06), ("media", 0.08), ("deleted", 0.02), ("notification", 0.02)]
+REPLIES = ["ok", "haha", "lol", "yes", "no", "👍", "😂😂", "thanks!", "on my way", "see you"]
+
+# Stages faster than this in the baseline are too noisy to flag
+MIN_BASELINE_SECONDS = 0.005
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+def chat_users(count, r):
+    # Names with spaces and accents and bare phone numbers, as exports show
+    # contacts that are not in the address book
+    users = []
+    for i in range(count):
+        if i % 5 == 4:
+            users.append(f"+{r.randint(1, 99)} {r.randint(300, 399)} {r.randint(1000000, 9999999)}")
+        else:
+            users.append(f"{r.choice(FIRST_NAMES)} {r.choice(LAST_NAMES)}" + (f" {i}" if i >= 40 else ""))
+    return users
+
+
+def _message(kind, r):
+    if kind == "text":
+        return " ".join(r.choices(WORDS, k=r.randint(1, 12)))
+    if kind == "multiline":
+        return "\n".join(" ".join(r.choices(WORDS, k=r.randint(1, 8))) for _ in range(r.randint(2, 4)))
+    if kind == "emoji":
+        return " ".join(r.choices(WORDS, k=r.randint(0, 5))) + " " + "".join(r.choices(EMOJIS, k=r.randint(1, 3)))
+    if kind == "url":
+        return f"have a look https://{r.choice(DOMAINS)}/{r.randint(1, 10 ** 6)} {r.choice(WORDS)}"
+    if kind == "media":
+        return "<Media omitted>"
+    if kind == "deleted":
+        return r.choice(["This message was deleted", "You deleted this message"])
+    return r.choice(REPLIES)
+
+
+def _notification(user, users, r):
+    # No "name: " prefix, so these are parsed as group notifications
+    return r.choice([
+        f"{user} joined using this group's invite link",
+        f"{user} left",
+        f"{user} added {r.choice(users)}",
+        f"{user} changed the group description",
+    ])
+
+
+def synthetic_chat(messages, style="android24", users=50, seed=0, block=10000):
+    # Yields a WhatsApp export in text blocks of `block` messages, so chats of
+    # tens of millions of lines can be written without holding them in
+    # memory. Messages are in time order, a few minutes apart on average, and
+    # a handful of users send most of them.
+    r = random.Random(seed)
+    header = STYLES[style]
+    names = chat_users(users, r)
+    activity = list(np.cumsum([1 / (rank + 1) for rank in range(users)]))
+    kinds, weights = zip(*KINDS)
+    kind_weights = list(np.cumsum(weights))
+
+    t = datetime.datetime(2021, 1, 1, 8, 0, 0)
+    step = datetime.timedelta(seconds=1)
+    lines = [header(t) + "Messages and calls are end-to-end encrypted. No one outside of this chat can read them.\n"]
+    for _ in range(messages):
+        t += step * int(r.expovariate(1 / 180))
+        user = r.choices(names, cum_weights=activity)[0]
+        kind = r.choices(kinds, cum_weights=kind_weights)[0]
+        if kind == "notification":
+            lines.append(header(t) + _notification(user, names, r) + "\n")
+        else:
+            lines.append(header(t) + user + ": " + _message(kind, r) + "\n")
+        if len(lines) >= block:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def write_chat(path, messages, style="android24", users=50, seed=0):
+    with open(path, "w", encoding="utf-8") as f:
+        for text in synthetic_chat(messages, style, users, seed):
+            f.write(text)
+
+
+def pipeline(text, measure):
+    # Each stage of turning an export into the /analyze response, in order.
+    # measure(name, fn) runs fn and returns its result.
+    records = measure("parse", lambda: list(preprocessing.iter_records((text,))))
+    dates, _, _ = measure("fields", lambda: preprocessing.parse_records(records))
+    measure("dates", lambda: preprocessing.parse_dates(pd.Series(dates, dtype=object)))
+    del records, dates
+
+    df = measure("preprocess", lambda: preprocessing.preprocess(text))
+    engine = measure("engine", lambda: AnalysisEngine(df))
+    for stage in STAGES:
+        measure("stage:" + stage, lambda: engine.prepare((stage,)))
+    measure("rollup", engine.activity)
+
+    encoded = {}
+    for section, build in analysis.SECTIONS.items():
+        data = measure("section:" + section, lambda: build(engine, "Overall"))
+        encoded[section] = measure("encode:" + section, lambda: analysis.encode_section(data))
+    measure("response", lambda: analysis.analysis_json(engine, encoded))
+
+
+def time_stages(text, repeat=1):
+    # Best wall time of each stage over `repeat` runs
+    seconds = {}
+
+    def measure(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        seconds[name] = min(seconds.get(name, elapsed), elapsed)
+        return result
+
+    for _ in range(repeat):
+        gc.collect()
+        pipeline(text, measure)
+    return seconds
+
+
+def memory_stages(text):
+    # Peak Python and NumPy allocations of each stage, over what was already
+    # allocated when it started
+    peaks = {}
+
+    def measure(name, fn):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[name] = max(peak - before, 0)
+        return result
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        pipeline(text, measure)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_benchmarks(sizes, style="android24", users=50, repeat=1, memory=True, log=sys.stderr):
+    results = {}
+    for size in sizes:
+        text = "".join(synthetic_chat(size, style, users))
+        print(f"{size} messages ({len(text) / 2 ** 20:.1f} MB)...", file=log)
+        seconds = time_stages(text, repeat)
+        peaks = memory_stages(text) if memory else {}
+        results[str(size)] = {
+            stage: {"seconds": round(elapsed, 6), "peak_mb": round(peaks[stage] / 2 ** 20, 3) if stage in peaks else None}
+            for stage, elapsed in seconds.items()
+        }
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    # (size, stage, seconds, baseline seconds) of every stage that got slower
+    # than baseline * (1 + threshold)
+    regressions = []
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None or base["seconds"] < MIN_BASELINE_SECONDS:
+                continue
+            if result["seconds"] > base["seconds"] * (1 + threshold):
+                regressions.append((size, stage, result["seconds"], base["seconds"]))
+    return regressions
+
+
+def print_report(results, baseline, out=sys.stdout):
+    print(f"{'stage':<28}{'messages':>10}{'seconds':>11}{'baseline':>11}{'change':>9}{'peak MB':>10}", file=out)
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            base_seconds = f"{base['seconds']:.4f}" if base else "-"
+            change = f"{result['seconds'] / base['seconds'] - 1:+.0%}" if base and base["seconds"] else "-"
+            peak = f"{result['peak_mb']:.1f}" if result["peak_mb"] is not None else "-"
+            print(f"{stage:<28}{size:>10}{result['seconds']:>11.4f}{base_seconds:>11}{change:>9}{peak:>10}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic chat exports and parsing/analysis benchmarks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a synthetic chat export")
+    generate.add_argument("path")
+    generate.add_argument("--messages", type=int, default=100000)
+    generate.add_argument("--style", choices=STYLES, default="android24")
+    generate.add_argument("--users", type=int, default=50)
+    generate.add_argument("--seed", type=int, default=0)
+
+    run = commands.add_parser("run", help="time and memory-profile each stage")
+    run.add_argument("--sizes", default="10000,100000", help="comma separated message counts (default: %(default)s)")
+    run.add_argument("--style", choices=STYLES, default="android24")
+    run.add_argument("--users", type=int, default=50)
+    run.add_argument("--repeat", type=int, default=3, help="timed runs per size; the best is kept (default: %(default)s)")
+    run.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    run.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file (default: %(default)s)")
+    run.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    run.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a stage counts as a regression (default: %(default)s)")
+    run.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        write_chat(args.path, args.messages, args.style, args.users, args.seed)
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = run_benchmarks(sizes, args.style, args.users, args.repeat, not args.no_memory)
+    document = {"environment": environment(), "style": args.style, "users": args.users, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if (stored.get("style"), stored.get("users")) == (args.style, args.users):
+            baseline = stored["results"]
+        else:
+            print("The baseline was recorded with another --style or --users; not comparing", file=sys.stderr)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for size, stage, seconds, base in regressions:
+        print(f"REGRESSION {stage} at {size} messages: {seconds:.4f}s vs {base:.4f}s baseline", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+import metrics
+import preprocessing
+from engine import ActivityRollup, AnalysisEngine, MESSAGE_FLAGS, UserStats
+
+# Memory budget shared by all cached chats and analysis results
+CACHE_MAX_BYTES = int(os.environ.get("CHAT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# Entries (and the chat sessions built on them) expire after this long without access
+CACHE_TTL_SECONDS = int(os.environ.get("CHAT_CACHE_TTL_SECONDS", 60 * 60))
+
+# Parsed chats are also written here when set, so they survive restarts. They
+# are stored as uncompressed Arrow IPC files and memory mapped on reload. The
+# message text stays in Arrow memory and numeric columns without nulls are
+# not copied either, so workers sharing the directory share those pages.
+CACHE_DIR = os.environ.get("CHAT_CACHE_DIR")
+
+# Bytes read from an upload at a time, so the raw export is never held in
+# memory as a whole next to the parsed chat
+READ_BLOCK_SIZE = int(os.environ.get("CHAT_READ_BLOCK_SIZE", 4 * 1024 * 1024))
+
+# Largest chat text read from an upload, after decompression; uploads read
+# into memory as a whole are held to it too. Larger ones are rejected, so a
+# small archive cannot expand without bound.
+MAX_EXPORT_BYTES = int(os.environ.get("MAX_EXPORT_BYTES", 1024 * 1024 * 1024))
+
+# Chat keys are a content hash, optionally suffixed with a date format hash
+CHAT_KEY_PATTERN = re.compile(r'[0-9a-f]{64}(-[0-9a-f]{8})?')
+
+
+class NotContinuation(Exception):
+    # A newer export that does not contain the stored chat's last messages
+    pass
+
+
+def content_hash(contents):
+    return hashlib.sha256(contents).hexdigest()
+
+
+class LimitedReader:
+    # Binary file object reading through to `fileobj` that raises ValueError
+    # once more than `limit` bytes have been read from it
+
+    def __init__(self, fileobj, limit=MAX_EXPORT_BYTES):
+        self.fileobj = fileobj
+        self.limit = limit
+        self.count = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.limit - self.count + 1
+        data = self.fileobj.read(size)
+        self.count += len(data)
+        if self.count > self.limit:
+            raise ValueError(f"The chat export is larger than {self.limit} bytes")
+        return data
+
+    def tell(self):
+        return self.count
+
+    def close(self):
+        self.fileobj.close()
+
+
+def read_blocks(fileobj, block_size=READ_BLOCK_SIZE):
+    while True:
+        block = fileobj.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+# Leading bytes of the archives an export may be uploaded in: WhatsApp's own
+# .zip export (chat text plus media) or a gzipped .txt
+ZIP_MAGIC = b"PK\x03\x04"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Raised while reading a damaged or truncated archive
+ARCHIVE_ERRORS = (zipfile.BadZipFile, gzip.BadGzipFile, EOFError, zlib.error)
+
+
+def _chat_member(zf):
+    # iOS exports name the chat _chat.txt, Android ones "WhatsApp Chat with
+    # <name>.txt"; media in the archive may include other text files
+    members = [info for info in zf.infolist() if not info.is_dir() and info.filename.lower().endswith(".txt")]
+    if not members:
+        raise ValueError("The archive does not contain a chat export (.txt)")
+    for info in members:
+        if os.path.basename(info.filename) == "_chat.txt":
+            return info
+    for info in members:
+        if os.path.basename(info.filename).startswith("WhatsApp Chat"):
+            return info
+    return max(members, key=lambda info: info.file_size)
+
+
+def open_export(fileobj):
+    # Binary file object of the chat text in an upload: the upload itself,
+    # or the chat member of a .zip or the contents of a .gz, decompressed as
+    # they are read. A zip's member is read in place, through its central
+    # directory, so neither archive is ever held in memory as a whole. The
+    # text is limited to MAX_EXPORT_BYTES.
+    magic = fileobj.read(len(ZIP_MAGIC))
+    fileobj.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        return LimitedReader(gzip.GzipFile(fileobj=fileobj, mode="rb"))
+    if magic == ZIP_MAGIC:
+        try:
+            zf = zipfile.ZipFile(fileobj)
+            return LimitedReader(zf.open(_chat_member(zf)))
+        except ARCHIVE_ERRORS as e:
+            raise ValueError(f"The upload is not a valid zip archive: {e}")
+    return LimitedReader(fileobj)
+
+
+def export_text(contents):
+    # Whole chat text of an export held in memory (plain, zip or gzip)
+    try:
+        return open_export(io.BytesIO(contents)).read().decode("utf-8")
+    except ARCHIVE_ERRORS as e:
+        raise ValueError(f"The upload is not a valid archive: {e}")
+
+
+def file_hash(fileobj):
+    digest = hashlib.sha256()
+    for block in read_blocks(fileobj):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+# Rows of a large frame whose footprint is measured to estimate the rest
+SIZEOF_SAMPLE_ROWS = 10000
+
+
+def _report_progress(blocks, fileobj, size, progress):
+    # Progress is the share of the upload read so far, which for an archive
+    # is its compressed bytes rather than the text decompressed from them
+    for block in blocks:
+        yield block
+        progress(min(fileobj.tell() / size, 1) if size else 1)
+
+
+def sizeof(obj):
+    # Rough in-memory footprint, good enough to keep the LRU within budget.
+    # Measuring every string of a large frame costs more than loading it, so
+    # those are extrapolated from an evenly spaced sample of rows.
+    if isinstance(obj, (pd.DataFrame, pd.Series)) and len(obj) > 2 * SIZEOF_SAMPLE_ROWS:
+        sample = obj.iloc[::len(obj) // SIZEOF_SAMPLE_ROWS]
+        return int(sizeof(sample) * len(obj) / len(sample))
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(obj, (np.ndarray, pd.api.extensions.ExtensionArray)):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(sizeof(i) for i in obj)
+    if isinstance(obj, (AnalysisEngine, ActivityRollup, UserStats)):
+        return sizeof(vars(obj))
+    return sys.getsizeof(obj)
+
+
+# Columns kept in Arrow memory when a stored chat is loaded, rather than
+# converted to one Python object per row
+ARROW_TYPES = {pa.string(): pd.ArrowDtype(pa.string()), pa.large_string(): pd.ArrowDtype(pa.large_string())}
+
+
+class ChatCache:
+    # LRU keyed by content hash, bounded by the estimated size of its entries
+    # and expiring entries that were not accessed within ttl seconds
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, cache_dir=CACHE_DIR, ttl=CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _expire(self, now):
+        # Entries are kept in access order, so the stale ones are at the front
+        while self.entries:
+            key, (_, nbytes, accessed) = next(iter(self.entries.items()))
+            if now - accessed < self.ttl:
+                break
+            del self.entries[key]
+            self.total_bytes -= nbytes
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries[key] = (entry[0], entry[1], now)
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted, _) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted
+
+    def put(self, key, value):
+        nbytes = sizeof(value)
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return value
+            self.entries[key] = (value, nbytes, now)
+            self.total_bytes += nbytes
+            self._evict()
+        if isinstance(value, AnalysisEngine):
+            value.on_grow = self.resize
+        return value
+
+    def resize(self, value):
+        # Measures an entry again once it has grown in place (an engine's
+        # stages and rollup are computed after it is cached), under every key
+        # it is stored with
+        nbytes = sizeof(value)
+        with self.lock:
+            for key, (entry, old, accessed) in list(self.entries.items()):
+                if entry is value:
+                    self.entries[key] = (entry, nbytes, accessed)
+                    self.total_bytes += nbytes - old
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".arrow")
+
+    def _read_chat(self, key):
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        with metrics.span("load"):
+            table = feather.read_table(self._path(key), memory_map=True)
+            df = table.drop_columns(list(MESSAGE_FLAGS)).to_pandas(split_blocks=True, types_mapper=ARROW_TYPES.get)
+            if isinstance(df['user'].dtype, pd.CategoricalDtype):
+                df['user'] = df['user'].astype(object)
+            df.attrs = json.loads(table.schema.metadata.get(b"chat_attrs", b"{}"))
+            return AnalysisEngine(df, table.select(list(MESSAGE_FLAGS)).to_pandas(split_blocks=True))
+
+    def _write_chat(self, key, engine):
+        # The parsed frame and the engine's per-message flags in one table.
+        # Users are dictionary encoded on disk; the frame's attrs (the date
+        # format) go into the schema metadata.
+        if not self.cache_dir:
+            return
+        with metrics.span("store"):
+            frame = pd.concat([engine.df, engine.messages[list(MESSAGE_FLAGS)]], axis=1)
+            if frame['user'].dtype == object:
+                frame['user'] = frame['user'].astype('category')
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            table = table.replace_schema_metadata({**table.schema.metadata, b"chat_attrs": json.dumps(engine.df.attrs).encode()})
+            tmp_path = self._path(key) + ".tmp"
+            feather.write_feather(table, tmp_path, compression="uncompressed")
+            os.replace(tmp_path, self._path(key))
+
+    def get_chat(self, key):
+        # Engine for an already uploaded chat, or None once it has expired
+        if not CHAT_KEY_PATTERN.fullmatch(key):
+            return None
+        engine = self.get(key)
+        if engine is not None:
+            return engine
+
+        engine = self._read_chat(key)
+        if engine is None:
+            return None
+        return self.put(key, engine)
+
+    def load_chat(self, contents, date_format=None):
+        return self.load_chat_file(io.BytesIO(contents), date_format)
+
+    def load_chat_file(self, fileobj, date_format=None, progress=None):
+        # Returns (chat key, engine), parsing the upload only on a cache miss.
+        # The file is read twice in blocks, once to hash it and once to parse;
+        # progress, if given, is called with the fraction parsed so far. The
+        # upload may be a .zip export or gzipped, see open_export; the key is
+        # the hash of the upload as sent. A date format only adds a suffix to
+        # it when the chat stored under the plain key was parsed with another.
+        with metrics.span("hash"):
+            key = file_hash(fileobj)
+        size = fileobj.tell()
+        fileobj.seek(0)
+
+        engine = self.get_chat(key)
+        if date_format and (engine is None or engine.df.attrs.get("date_format") != date_format):
+            key += "-" + content_hash(date_format.encode())[:8]
+            engine = self.get_chat(key)
+        if engine is not None:
+            return key, engine
+
+        export = open_export(fileobj)
+        blocks = read_blocks(export)
+        if progress is not None:
+            blocks = _report_progress(blocks, fileobj, size, progress)
+        text = preprocessing.decode_chunks(blocks)
+        try:
+            with metrics.span("preprocess"):
+                df = preprocessing.preprocess(text, date_format=date_format)
+        except ARCHIVE_ERRORS as e:
+            raise ValueError(f"The upload is not a valid archive: {e}")
+        metrics.parsed(export.tell(), len(df))
+        engine = AnalysisEngine(df)
+        self._write_chat(key, engine)
+        return key, self.put(key, engine)
+
+    def append_chat(self, key, contents):
+        # Returns (chat key, engine, number of new messages) for a newer export
+        # of the stored chat `key`, parsing only the messages after the stored
+        # ones; None when that chat has expired
+        engine = self.get_chat(key)
+        if engine is None:
+            return None
+
+        new_key = content_hash(contents)
+        tail = preprocessing.find_new_messages(export_text(contents), engine.df)
+        if tail is None:
+            raise NotContinuation("The export does not continue this chat")
+
+        with metrics.span("preprocess"):
+            df = preprocessing.preprocess(tail, date_format=engine.df.attrs.get("date_format"))
+        metrics.parsed(len(tail.encode("utf-8")), len(df))
+        if not df.empty:
+            engine = engine.extend(df)
+        # Also stored when nothing was added, so the new key outlives a restart
+        if new_key != key:
+            self._write_chat(new_key, engine)
+        return new_key, self.put(new_key, engine), len(df)
+
+
+chat_cache = ChatCache()
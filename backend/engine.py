@@ -0,0 +1,603 @@
+import copy
+import threading
+from collections import Counter
+import numpy as np
+import pandas as pd
+import helper
+import metrics
+from preprocessing import MONTH_NAMES, DAY_NAMES, PERIODS
+
+
+# Per-message aggregates that are computed on demand. Word counts are one
+# Python pass over the messages; tokens, emojis, links and sentiment are
+# batch passes over the whole message column.
+STAGES = ('words', 'emojis', 'links', 'tokens', 'sentiment')
+
+# Per-message columns computed when an engine is built. They are stored with
+# the parsed chat, so reloading it does not have to recompute them.
+MESSAGE_FLAGS = ('is_notification', 'is_media', 'is_deleted', 'is_empty', 'is_text', 'length')
+
+
+def message_flags(df):
+    # Plain Python passes over the message list; pandas' string methods
+    # cost several times more per row on object columns
+    messages = df['message'].tolist()
+    length = np.fromiter(map(len, messages), dtype=np.int64, count=len(messages))
+    is_notification = df['user'] == 'group_notification'
+    is_media = df['message'] == helper.MEDIA_MESSAGE
+    return pd.DataFrame({
+        'is_notification': is_notification,
+        'is_media': is_media,
+        'is_deleted': helper.match_mask(messages, length, helper.DELETED_PATTERN),
+        'is_empty': np.array([not message.strip() for message in messages], dtype=bool),
+        'is_text': ~is_notification & ~is_media,
+        'length': length,
+    }, index=df.index)
+
+
+def _names(codes, categories, name):
+    return pd.CategoricalIndex(pd.Categorical.from_codes(codes, categories, ordered=True), name=name)
+
+
+def _runs(*keys):
+    # Start of each run of equal rows in already sorted key arrays
+    new = np.zeros(len(keys[0]), dtype=bool)
+    new[:1] = True
+    for key in keys:
+        new[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(new)
+
+
+def _codes(bounds):
+    # User code of each row of a table sliced per user by `bounds`
+    return np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+
+
+# First row of a user's messages in a category they have none in
+NOT_SEEN = np.iinfo(np.int64).max
+
+
+def _first_rows(codes, categories, users, size, rows):
+    # Row of each user's first message in each category, as a users x size
+    # table; `rows` are the messages' rows, in order
+    first = np.full((users, size), NOT_SEEN, dtype=np.int64)
+    keys, index = np.unique(codes * size + categories, return_index=True)
+    first.flat[keys] = rows[index]
+    return first
+
+
+def _shifted(first, offset):
+    return np.where(first == NOT_SEEN, NOT_SEEN, first + offset)
+
+
+def _merged_first_rows(first, tail_first, tail_codes, users, offset):
+    merged = np.full((users, first.shape[1]), NOT_SEEN, dtype=np.int64)
+    merged[:len(first)] = first
+    merged[tail_codes] = np.minimum(merged[tail_codes], _shifted(tail_first, offset))
+    return merged
+
+
+def _summed(keys, counts, order):
+    # Keys in `order` with the counts of equal keys added up
+    keys = [key[order] for key in keys]
+    starts = _runs(*keys)
+    return [key[starts] for key in keys], np.add.reduceat(counts[order], starts)
+
+
+class ActivityRollup:
+    # Message counts per (user, day, hour), and per (user, timestamp) for the
+    # daily timeline, built in one pass over a chat. Both tables are sorted by
+    # user, so one user's counts are a contiguous slice and 'Overall' is the
+    # whole table summed across users. Messages without a parsed date are left
+    # out, as they were by the groupbys these views replace. The row of each
+    # user's first message on every weekday and in every month is kept too,
+    # as value_counts() puts tied days and months in order of appearance.
+
+    def __init__(self, df):
+        dates = df['date'].to_numpy()
+        valid = ~np.isnat(dates)
+        dates = dates[valid]
+        codes, users = pd.factorize(df['user'].to_numpy()[valid])
+        self.users = {user: i for i, user in enumerate(users)}
+        self.year_dtype = df['year'].dtype
+        self.month_dtype = df['month_num'].dtype
+
+        # Slots count hours from midnight of the first day
+        days = dates.astype('datetime64[D]')
+        rows = np.flatnonzero(valid)
+        self.length = len(df)
+        weekdays = (days.astype(np.int64) + 3) % 7
+        months = days.astype('datetime64[M]').astype(np.int64) % 12
+        self.first_weekday = _first_rows(codes, weekdays, len(users), 7, rows)
+        self.first_month = _first_rows(codes, months, len(users), 12, rows)
+        self.first_day = days.min() if len(days) else np.datetime64(0, 'D')
+        hours = (dates - self.first_day).astype('timedelta64[h]').astype(np.int64)
+        slots = int(hours.max()) + 1 if len(hours) else 1
+        keys, self.counts = np.unique(codes * slots + hours, return_counts=True)
+        user_codes, self.slots = np.divmod(keys, slots)
+        self.bounds = np.searchsorted(user_codes, np.arange(len(users) + 1))
+        self._calendar(slots)
+
+        # Exports are normally in time order already, which saves the sorts
+        in_order = bool(np.all(dates[1:] >= dates[:-1]))
+        if in_order:
+            starts = _runs(dates)
+            self.overall_stamps = dates[starts]
+            self.overall_stamp_counts = np.diff(np.append(starts, len(dates)))
+            order = np.argsort(codes, kind='stable')
+        else:
+            self.overall_stamps, self.overall_stamp_counts = np.unique(dates, return_counts=True)
+            order = np.lexsort((dates, codes))
+        codes, dates = codes[order], dates[order]
+        starts = _runs(codes, dates)
+        self.stamps = dates[starts]
+        self.stamp_counts = np.diff(np.append(starts, len(dates)))
+        self.stamp_bounds = np.searchsorted(codes[starts], np.arange(len(users) + 1))
+
+    def _calendar(self, slots):
+        # Calendar of each day in the chat's range (1970-01-01 was a Thursday)
+        calendar = self.first_day + np.arange(slots // 24 + 1)
+        self.day_month = calendar.astype('datetime64[M]').astype(np.int64)
+        self.day_weekday = (calendar.astype(np.int64) + 3) % 7
+
+    def extend(self, df):
+        # Rollup of the chat with the later messages in `df` added. Only those
+        # messages are grouped; the result is merged with this rollup's tables,
+        # which hold one row per user and hour or timestamp, not per message.
+        tail = ActivityRollup(df)
+        if not len(tail.counts):
+            merged = copy.copy(self)
+            merged.length += tail.length
+            return merged
+        if not len(self.counts):
+            merged = copy.copy(tail)
+            merged.length += self.length
+            merged.first_weekday = _shifted(tail.first_weekday, self.length)
+            merged.first_month = _shifted(tail.first_month, self.length)
+            return merged
+
+        merged = copy.copy(self)
+        merged.users = dict(self.users)
+        for user in tail.users:
+            merged.users.setdefault(user, len(merged.users))
+        tail_codes = np.array([merged.users[user] for user in tail.users], dtype=np.int64)
+        users = np.arange(len(merged.users) + 1)
+        merged.length = self.length + tail.length
+        merged.first_weekday = _merged_first_rows(self.first_weekday, tail.first_weekday, tail_codes, len(merged.users), self.length)
+        merged.first_month = _merged_first_rows(self.first_month, tail.first_month, tail_codes, len(merged.users), self.length)
+
+        merged.first_day = min(self.first_day, tail.first_day)
+        old_slots = self.slots + (self.first_day - merged.first_day).astype(np.int64) * 24
+        tail_slots = tail.slots + (tail.first_day - merged.first_day).astype(np.int64) * 24
+        slots = int(max(old_slots.max(), tail_slots.max())) + 1
+        keys = np.concatenate([_codes(self.bounds) * slots + old_slots, tail_codes[_codes(tail.bounds)] * slots + tail_slots])
+        counts = np.concatenate([self.counts, tail.counts])
+        (keys,), merged.counts = _summed([keys], counts, np.argsort(keys, kind='stable'))
+        user_codes, merged.slots = np.divmod(keys, slots)
+        merged.bounds = np.searchsorted(user_codes, users)
+        merged._calendar(slots)
+
+        stamps = np.concatenate([self.overall_stamps, tail.overall_stamps])
+        counts = np.concatenate([self.overall_stamp_counts, tail.overall_stamp_counts])
+        (merged.overall_stamps,), merged.overall_stamp_counts = _summed([stamps], counts, np.argsort(stamps, kind='stable'))
+
+        codes = np.concatenate([_codes(self.stamp_bounds), tail_codes[_codes(tail.stamp_bounds)]])
+        stamps = np.concatenate([self.stamps, tail.stamps])
+        counts = np.concatenate([self.stamp_counts, tail.stamp_counts])
+        (codes, merged.stamps), merged.stamp_counts = _summed([codes, stamps], counts, np.lexsort((stamps, codes)))
+        merged.stamp_bounds = np.searchsorted(codes, users)
+        return merged
+
+    def _slice(self, selected_user, bounds):
+        i = self.users.get(selected_user)
+        if i is None:
+            return slice(0, 0)
+        return slice(bounds[i], bounds[i + 1])
+
+    def _hours(self, selected_user):
+        if selected_user == 'Overall':
+            return self.slots, self.counts
+        rows = self._slice(selected_user, self.bounds)
+        return self.slots[rows], self.counts[rows]
+
+    def _week_hours(self, selected_user):
+        # 7 x 24 counts, Monday first
+        slots, counts = self._hours(selected_user)
+        day, hour = np.divmod(slots, 24)
+        cells = self.day_weekday[day] * 24 + hour
+        return np.bincount(cells, weights=counts, minlength=7 * 24).astype(np.int64).reshape(7, 24)
+
+    def _first(self, selected_user, first):
+        # Row of the first message in each category
+        if selected_user == 'Overall':
+            return first.min(axis=0, initial=NOT_SEEN)
+        i = self.users.get(selected_user)
+        return first[i] if i is not None else np.full(first.shape[1], NOT_SEEN)
+
+    def _value_counts(self, counts, first, categories, name):
+        # Same order as Series.value_counts() on the column of names: most
+        # messages first, ties in order of appearance
+        order = np.lexsort((first, -counts))
+        order = order[counts[order] > 0]
+        return pd.Series(counts[order], index=_names(order, categories, name), name='count')
+
+    def monthly_timeline(self, selected_user):
+        slots, counts = self._hours(selected_user)
+        months = self.day_month[slots // 24]
+        first = months.min() if len(months) else 0
+        totals = np.bincount(months - first, weights=counts).astype(np.int64)
+        present = np.flatnonzero(totals)
+        year, month = np.divmod(present + first, 12)
+
+        timeline = pd.DataFrame({
+            'year': pd.Series(year + 1970).astype(self.year_dtype),
+            'month_num': pd.Series(month + 1).astype(self.month_dtype),
+            'month': pd.Categorical.from_codes(month, MONTH_NAMES, ordered=True),
+            'message': totals[present],
+        })
+        timeline['time'] = helper.timeline_labels(timeline)
+        return timeline
+
+    def daily_timeline(self, selected_user):
+        if selected_user == 'Overall':
+            stamps, counts = self.overall_stamps, self.overall_stamp_counts
+        else:
+            rows = self._slice(selected_user, self.stamp_bounds)
+            stamps, counts = self.stamps[rows], self.stamp_counts[rows]
+        return pd.DataFrame({'date': stamps, 'message': counts})
+
+    def week_activity_map(self, selected_user):
+        counts = self._week_hours(selected_user).sum(axis=1)
+        return self._value_counts(counts, self._first(selected_user, self.first_weekday), DAY_NAMES, 'day_name')
+
+    def month_activity_map(self, selected_user):
+        slots, counts = self._hours(selected_user)
+        month = self.day_month[slots // 24] % 12
+        counts = np.bincount(month, weights=counts, minlength=12).astype(np.int64)
+        return self._value_counts(counts, self._first(selected_user, self.first_month), MONTH_NAMES, 'month')
+
+    def activity_heatmap(self, selected_user):
+        # Like pivot_table().fillna(0) on the columns of names: only the days
+        # and periods with messages, each sorted by name, and float counts
+        # once a cell had to be filled
+        week_hours = self._week_hours(selected_user)
+        days = np.array(sorted(np.flatnonzero(week_hours.sum(axis=1)), key=DAY_NAMES.__getitem__), dtype=np.int64)
+        periods = np.array(sorted(np.flatnonzero(week_hours.sum(axis=0)), key=PERIODS.__getitem__), dtype=np.int64)
+        cells = week_hours[np.ix_(days, periods)]
+        if (cells == 0).any():
+            cells = cells.astype(float)
+        return pd.DataFrame(cells, index=_names(days, DAY_NAMES, 'day_name'), columns=_names(periods, PERIODS, 'period'))
+
+
+class UserStats:
+    # Per-user totals behind user_detailed_stats, kept so that appended
+    # messages only add to them: sums, first and last dates, the distinct
+    # days and every response time (for the median) of each user. `previous`
+    # is the (user, date) of the message before these, if any, for the
+    # response time of the first one.
+
+    def __init__(self, users, dates, words, emojis, media, previous=None):
+        users = pd.Series(users.to_numpy(dtype=object))
+        dates = pd.Series(dates.to_numpy())
+        before_users, before_dates = users.shift(), dates.shift()
+        if previous is not None and len(users):
+            before_users.iloc[0], before_dates.iloc[0] = previous
+        per_message = pd.DataFrame({
+            'user': users,
+            'date': dates,
+            'day': dates.dt.normalize(),
+            'words': words.to_numpy(),
+            'emojis': emojis.to_numpy(),
+            'media': media.to_numpy(),
+            'response': (dates - before_dates).where(users.ne(before_users)).dt.total_seconds() / 60,
+        })
+        self.totals = per_message.groupby('user', sort=False).agg(
+            Messages=('user', 'size'),
+            Words=('words', 'sum'),
+            Emojis=('emojis', 'sum'),
+            Media=('media', 'sum'),
+            first=('date', 'min'),
+            last=('date', 'max'),
+        )
+        self.days = {user: days.unique() for user, days in per_message['day'].dropna().groupby(per_message['user'], sort=False)}
+        self.responses = {user: times.to_numpy() for user, times in per_message['response'].dropna().groupby(per_message['user'], sort=False)}
+        self.previous = (users.iloc[-1], dates.iloc[-1]) if len(users) else previous
+
+    def extend(self, users, dates, words, emojis, media):
+        tail = UserStats(users, dates, words, emojis, media, self.previous)
+        merged = copy.copy(self)
+        index = self.totals.index.append(tail.totals.index.difference(self.totals.index, sort=False))
+        old, new = self.totals.reindex(index), tail.totals.reindex(index)
+        sums = ['Messages', 'Words', 'Emojis', 'Media']
+        merged.totals = old[sums].fillna(0).astype(self.totals[sums].dtypes) + new[sums].fillna(0).astype(self.totals[sums].dtypes)
+        merged.totals['first'] = np.fmin(old['first'], new['first'])
+        merged.totals['last'] = np.fmax(old['last'], new['last'])
+        merged.days = _merge_arrays(self.days, tail.days, lambda a, b: np.union1d(a, b))
+        merged.responses = _merge_arrays(self.responses, tail.responses, lambda a, b: np.concatenate([a, b]))
+        merged.previous = tail.previous
+        return merged
+
+    def table(self):
+        # Same table as helper.user_stats_table over all the messages
+        no_response = np.array([])
+        user_data = self.totals.assign(**{
+            'First Seen': self.totals['first'],
+            'Last Seen': self.totals['last'],
+            'Active Days': [len(self.days.get(user, ())) for user in self.totals.index],
+            'Median Response (min)': [
+                np.median(times) if len(times) else np.nan
+                for times in (self.responses.get(user, no_response) for user in self.totals.index)
+            ],
+        }).drop(columns=['first', 'last'])
+        user_data = user_data.rename_axis('User').reset_index()
+        user_data['Median Response (min)'] = user_data['Median Response (min)'].round(2)
+        return user_data.sort_values(by='Messages', ascending=False)
+
+
+def _merge_arrays(arrays, new_arrays, merge):
+    merged = dict(arrays)
+    for key, values in new_arrays.items():
+        merged[key] = merge(arrays[key], values) if key in arrays else values
+    return merged
+
+
+def _merge_counters(counters, new_counters):
+    merged = dict(counters)
+    for key, counts in new_counters.items():
+        merged[key] = counters[key] + counts if key in counters else counts
+    return merged
+
+
+class AnalysisEngine:
+    # Scans the messages of a parsed chat once per batch of requested stages
+    # and keeps the per-message counts and per-user frequency tables. Each
+    # method mirrors the helper function of the same name and is answered
+    # from those shared aggregates.
+
+    def __init__(self, df, flags=None):
+        self.df = df
+        self.rows = df.groupby('user', sort=False).indices
+        self.stages = set()
+        self._new_locks()
+        self.tokens = {}
+        self.emojis = {}
+        self.links = None
+        self.rollup = None
+        self.user_stats = None
+        # Called after the engine grows, so the cache holding it can account
+        # for the new size
+        self.on_grow = None
+
+        if flags is None:
+            with metrics.span("flags"):
+                flags = message_flags(df)
+        self.messages = flags[list(MESSAGE_FLAGS)]
+        self.messages.insert(0, 'user', df['user'])
+
+    def _new_locks(self):
+        # Requests for the same chat can run on several worker threads. Each
+        # stage (and the rollup and user stats) is built under a lock of its
+        # own, so one slow stage does not hold up sections that need others.
+        # A finished stage is published by replacing the attributes it
+        # changes (under `lock`, briefly), never by changing them in place,
+        # so readers use whatever they find without locking.
+        self.lock = threading.Lock()
+        self.building = {name: threading.Lock() for name in (*STAGES, 'rollup', 'user_stats')}
+
+    def extend(self, df):
+        # Engine for this chat with the later messages in `df` appended. The
+        # stages already computed here are computed for the new rows only and
+        # merged into copies of the existing aggregates.
+        with self.lock:
+            offset = len(self.df)
+            df = df.set_axis(df.index + offset)
+            new = AnalysisEngine(df)
+            new.prepare(self.stages)
+
+            merged = copy.copy(self)
+            merged.df = pd.concat([self.df, df])
+            merged.df.attrs = dict(self.df.attrs)
+            merged.messages = pd.concat([self.messages, new.messages])
+            merged.stages = set(self.stages)
+            merged._new_locks()
+            if self.rollup is not None:
+                merged.rollup = self.rollup.extend(df)
+            if self.user_stats is not None:
+                m = new.messages[~new.messages['is_notification']]
+                merged.user_stats = self.user_stats.extend(m['user'], df['date'][m.index], m['word_count'], m['emoji_count'], m['is_media'])
+
+            merged.rows = dict(self.rows)
+            for user, rows in new.rows.items():
+                rows = rows + offset
+                merged.rows[user] = np.concatenate([self.rows[user], rows]) if user in self.rows else rows
+
+            merged.tokens = _merge_counters(self.tokens, new.tokens)
+            merged.emojis = _merge_counters(self.emojis, new.emojis)
+            if self.links is not None:
+                links = new.links.assign(row=new.links['row'] + offset)
+                merged.links = pd.concat([self.links, links], ignore_index=True)
+            return merged
+
+    def prepare(self, stages):
+        builders = {
+            'words': self._count_words,
+            'emojis': self._count_emojis,
+            'links': self._extract_links,
+            'tokens': self._index_tokens,
+            'sentiment': self._score_sentiment,
+        }
+        grown = False
+        for stage in STAGES:
+            if stage not in stages or stage in self.stages:
+                continue
+            with self.building[stage]:
+                if stage in self.stages:
+                    continue
+                with metrics.span(stage):
+                    builders[stage]()
+                grown = True
+        if grown:
+            self._grown()
+
+    def _grown(self):
+        if self.on_grow is not None:
+            self.on_grow(self)
+
+    def _publish(self, stage, columns=None, **attributes):
+        # New per-message columns and replaced aggregates of a finished stage
+        with self.lock:
+            if columns:
+                self.messages = self.messages.assign(**columns)
+            for name, value in attributes.items():
+                setattr(self, name, value)
+            self.stages.add(stage)
+
+    def _count_words(self):
+        self._publish('words', {'word_count': [len(message.split()) for message in self.df['message'].tolist()]})
+
+    def _index_tokens(self):
+        # Unfiltered token counts per user (and overall, which keeps the
+        # chat's first-seen order for ties); stop words are dropped at query
+        # time so any stop-word configuration reuses the same index
+        text = self.messages['is_text'].to_numpy()
+        messages = self.df['message'].to_numpy(dtype=object)
+        tokens = {'Overall': helper.token_counts(messages[text])}
+        for user, rows in self.rows.items():
+            tokens[user] = helper.token_counts(messages[rows[text[rows]]])
+        self._publish('tokens', tokens=tokens)
+
+    def _score_sentiment(self):
+        # Scored once per chat; per-user views only filter these scores
+        text = self.messages['is_text']
+        scores = np.full(len(self.df), np.nan)
+        scores[text.to_numpy()] = helper.sentiment_scores(self.df['message'][text])
+        self._publish('sentiment', {'sentiment_score': scores})
+
+    def _count_emojis(self):
+        # One regex pass over the whole message column; matches are mapped
+        # back to their rows and then grouped per user (keeping message order)
+        rows, found = helper.extract_emojis(self.df['message'].astype(object, copy=False))
+
+        codes, users = pd.factorize(self.df['user'])
+        match_codes = codes[rows]
+        order = np.argsort(match_codes, kind='stable')
+        bounds = np.searchsorted(match_codes[order], np.arange(len(users) + 1))
+        by_user = np.array(found, dtype=object)[order]
+
+        emojis = {'Overall': Counter(found)}
+        for i, user in enumerate(users):
+            emojis[user] = Counter(by_user[bounds[i]:bounds[i + 1]].tolist())
+        self._publish('emojis', {'emoji_count': np.bincount(rows, minlength=len(self.df))}, emojis=emojis)
+
+    def _extract_links(self):
+        links = helper.extract_links(self.df['message'].astype(object, copy=False))
+        links['user'] = self.df['user'].to_numpy()[links['row']]
+        self._publish('links', {'link_count': np.bincount(links['row'], minlength=len(self.df))}, links=links)
+
+    def _select(self, frame, selected_user):
+        if selected_user == 'Overall':
+            return frame
+        return frame.iloc[self.rows.get(selected_user, [])]
+
+    def user_df(self, selected_user):
+        return self._select(self.df, selected_user)
+
+    def user_messages(self, selected_user):
+        return self._select(self.messages, selected_user)
+
+    def fetch_stats(self, selected_user):
+        self.prepare(('words', 'links'))
+        m = self.user_messages(selected_user)
+        return m.shape[0], int(m['word_count'].sum()), int(m['is_media'].sum()), int(m['link_count'].sum())
+
+    def links_shared(self, selected_user):
+        self.prepare(('links',))
+        links = self.links
+        if selected_user != 'Overall':
+            links = links[links['user'] == selected_user]
+        domains = links['domain'].value_counts().rename_axis('domain').reset_index(name='count')
+        users = links['user'].value_counts().rename_axis('user').reset_index(name='count')
+        return domains, users
+
+    def most_busy_users(self):
+        return helper.most_busy_users(self.df)
+
+    def word_counts(self, selected_user, stop_words=helper.STOP_WORDS):
+        self.prepare(('tokens',))
+        counts = self.tokens.get(selected_user, Counter())
+        return helper.without_stop_words(counts, stop_words)
+
+    def create_wordcloud(self, selected_user, stop_words=helper.STOP_WORDS, size=500):
+        return helper.wordcloud_from_counts(self.word_counts(selected_user, stop_words), size, size)
+
+    def most_common_words(self, selected_user, stop_words=helper.STOP_WORDS):
+        return pd.DataFrame(self.word_counts(selected_user, stop_words).most_common(20))
+
+    def emoji_helper(self, selected_user):
+        self.prepare(('emojis',))
+        counts = self.emojis.get(selected_user, Counter())
+        return pd.DataFrame(counts.most_common())
+
+    def activity(self):
+        # Built on first use; every timeline and activity view is a slice of it
+        if self.rollup is None:
+            with self.building['rollup']:
+                if self.rollup is None:
+                    with metrics.span("rollup"):
+                        self.rollup = ActivityRollup(self.df)
+                    self._grown()
+        return self.rollup
+
+    def monthly_timeline(self, selected_user):
+        return self.activity().monthly_timeline(selected_user)
+
+    def daily_timeline(self, selected_user):
+        return self.activity().daily_timeline(selected_user)
+
+    def week_activity_map(self, selected_user):
+        return self.activity().week_activity_map(selected_user)
+
+    def month_activity_map(self, selected_user):
+        return self.activity().month_activity_map(selected_user)
+
+    def activity_heatmap(self, selected_user):
+        return self.activity().activity_heatmap(selected_user)
+
+    def sentiment_analysis(self, selected_user):
+        self.prepare(('sentiment',))
+        m = self.user_messages(selected_user)
+        m = m[m['is_text']]
+
+        scores = m['sentiment_score'].to_numpy()
+        labels = pd.Series(helper.sentiment_labels(scores), name='sentiment')
+        samples = self.df.loc[m.index[:10], ['user', 'message']].assign(
+            sentiment=labels.iloc[:10].to_numpy(), sentiment_score=scores[:10])
+        return labels.value_counts(), samples
+
+    def user_detailed_stats(self):
+        if self.user_stats is None:
+            with self.building['user_stats']:
+                if self.user_stats is None:
+                    self.prepare(('words', 'emojis'))
+                    m = self.messages
+                    m = m[~m['is_notification']]
+                    self.user_stats = UserStats(m['user'], self.df['date'][m.index], m['word_count'], m['emoji_count'], m['is_media'])
+                    self._grown()
+        return self.user_stats.table()
+
+    def extra_stats(self, selected_user):
+        self.prepare(('words',))
+        m = self.user_messages(selected_user)
+        m = m[~m['is_notification']]
+
+        if m.empty:
+            return 0, 0, 0, 0, 0, 0
+
+        return (
+            int(m['is_deleted'].sum()),
+            int(m['is_empty'].sum()),
+            float(round(m['length'].mean(), 2)),
+            int(m['length'].max()),
+            float(round(m['word_count'].mean(), 2)),
+            int(m['word_count'].max()),
+        )
@@ -1,12 +1,160 @@
 from urlextract import URLExtract
-from wordcloud import WordCloud
+from wordcloud import WordCloud, STOPWORDS as WORDCLOUD_STOPWORDS
+from wordcloud.tokenization import process_tokens
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import re
+import threading
+import numpy as np
 import pandas as pd
 from collections import Counter
 import emoji
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from sentiment_worker import compound_score
 
 extract = URLExtract()
-analyzer = SentimentIntensityAnalyzer()
+
+MEDIA_MESSAGE = '<Media omitted>\n'
+
+# Deleted messages patterns (WhatsApp specific)
+DELETED_PATTERNS = ['This message was deleted', 'You deleted this message']
+
+def _deleted_pattern():
+    # Case-insensitive match of any deleted pattern. The branches share a
+    # plain first-letter class so that re can scan for it quickly, which it
+    # cannot do for an IGNORECASE alternation.
+    firsts = [{pattern[0].lower(), pattern[0].upper()} for pattern in DELETED_PATTERNS]
+    branches = ['(?<=[%s])(?i:%s)' % (''.join(sorted(first)), re.escape(pattern[1:]))
+                for first, pattern in zip(firsts, DELETED_PATTERNS)]
+    return re.compile('[%s](?:%s)' % (''.join(sorted(set().union(*firsts))), '|'.join(branches)))
+
+DELETED_PATTERN = _deleted_pattern()
+
+# Every URL URLExtract reports has a dot before its TLD, is an IPv4 address
+# or is localhost, so messages without any of these can be skipped
+LINK_CANDIDATE_PATTERN = r'\.[^\W\d_]|\d\.\d+\.\d|localhost'
+
+# Worker processes used to score sentiment on large chats (0 or 1 scores in-process).
+# They are started once, on first use, and shared by every request; spawned
+# rather than forked, since the server forking from its worker threads can
+# leave a child holding another thread's lock. A spawned worker still imports
+# the server's main module, so that module keeps its side effects in startup.
+SENTIMENT_PROCESSES = int(os.environ.get("SENTIMENT_PROCESSES", 0))
+SENTIMENT_POOL_MIN_TEXTS = 20000
+
+_sentiment_pool = None
+_sentiment_pool_lock = threading.Lock()
+
+# Basic stop words, plus any comma separated EXTRA_STOP_WORDS from the environment
+BASE_STOP_WORDS = frozenset(["the", "a", "is", "am", "are", "and", "or", "to", "in", "it", "i", "you", "my", "me", "was", "for", "with", "on", "this", "that", "of", "at", "but", "not", "have", "be", "as", "do", "we", "your", "can", "if", "so", "up", "all", "get", "go", "out", "now", "just", "like", "they", "will"])
+
+def stop_word_set(extra=None, base=None):
+    # Lowercased set so that filtering a token is a single hash lookup;
+    # extends STOP_WORDS unless another base set is given
+    base = STOP_WORDS if base is None else base
+    if not extra:
+        return base
+    if isinstance(extra, str):
+        extra = extra.split(",")
+    return base | frozenset(word.strip().lower() for word in extra if word.strip())
+
+STOP_WORDS = stop_word_set(os.environ.get("EXTRA_STOP_WORDS"), BASE_STOP_WORDS)
+
+# Word pattern WordCloud.generate tokenizes with (min_word_length=0, so
+# single characters count), applied to the token index instead of the raw text
+CLOUD_WORD_PATTERN = re.compile(r"\w[\w']*")
+
+def _char_class(codepoints, gap):
+    # Character class of codepoint ranges; above U+2000 ranges closer than
+    # `gap` are merged, which keeps the class short for the regex engine
+    codepoints = sorted(codepoints)
+    ranges = [[codepoints[0], codepoints[0]]]
+    for cp in codepoints[1:]:
+        if cp - ranges[-1][1] <= (1 if cp < 0x2000 else gap):
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return '[' + ''.join(re.escape(chr(a)) + ('-' + re.escape(chr(b)) if b > a else '') for a, b in ranges) + ']'
+
+def _build_emoji_pattern():
+    # Matches whole emoji sequences (keycaps, flags, tag flags, skin tones and
+    # ZWJ sequences) rather than single characters. Every branch starts with
+    # the same coarse class so the regex engine can skip ordinary text in C;
+    # the lookbehinds then check the exact character.
+    first = _char_class({ord(e[0]) for e in emoji.EMOJI_DATA}, 1024)
+    base = _char_class({ord(e[0]) for e in emoji.EMOJI_DATA
+                        if ord(e[0]) > 0x7f and (len(e) == 1 or e[1] == '\ufe0f')}, 1)
+    modifier = '(?:\ufe0f|[\U0001F3FB-\U0001F3FF])?'
+    return re.compile(
+        first + '(?<=[#*0-9])\ufe0f?\u20e3'
+        '|' + first + '(?<=[\U0001F1E6-\U0001F1FF])[\U0001F1E6-\U0001F1FF]'
+        '|' + first + '(?<=\U0001F3F4)[\U000E0020-\U000E007E]+\U000E007F'
+        '|' + first + r'(?<=[^\x00-\x7f])(?<=' + base + ')' + modifier +
+        '(?:\u200d' + base + modifier + ')*'
+    )
+
+EMOJI_PATTERN = _build_emoji_pattern()
+
+def find_emojis(text):
+    return EMOJI_PATTERN.findall(text)
+
+def extract_emojis(messages):
+    # Scans the whole column as one string and returns the row position and
+    # the emoji for every emoji found, in message order
+    lengths = messages.str.len().to_numpy() + 1
+    starts = np.cumsum(lengths) - lengths
+    text = '\n'.join(messages)
+
+    positions = []
+    emojis = []
+    for match in EMOJI_PATTERN.finditer(text):
+        positions.append(match.start())
+        emojis.append(match.group())
+
+    rows = np.searchsorted(starts, positions, side='right') - 1
+    return rows, emojis
+
+def match_mask(messages, lengths, pattern):
+    # Marks the messages containing a match, found with one search over the
+    # newline joined column; the pattern must not match across a newline
+    starts = np.cumsum(lengths + 1) - (lengths + 1)
+    positions = [match.start() for match in pattern.finditer('\n'.join(messages))]
+    mask = np.zeros(len(lengths), dtype=bool)
+    mask[np.searchsorted(starts, positions, side='right') - 1] = True
+    return mask
+
+def url_domain(url):
+    domain = re.sub(r'^[a-z][a-z0-9+.-]*://', '', url.lower())
+    domain = re.split(r'[/?#:]', domain, maxsplit=1)[0]
+    return domain[4:] if domain.startswith('www.') else domain
+
+def extract_links(messages):
+    # URLExtract is slow and finds nothing in most messages, so only the
+    # messages passing a cheap vectorized prefilter are handed to it
+    candidates = messages.str.contains(LINK_CANDIDATE_PATTERN, case=False, regex=True).to_numpy(dtype=bool)
+
+    rows = []
+    urls = []
+    for row in np.flatnonzero(candidates):
+        for url in extract.find_urls(messages.iat[row]):
+            rows.append(row)
+            urls.append(url)
+
+    return pd.DataFrame({
+        'row': np.array(rows, dtype=np.int64),
+        'url': pd.Series(urls, dtype=object),
+        'domain': pd.Series([url_domain(url) for url in urls], dtype=object),
+    })
+
+def links_shared(selected_user, df):
+    if selected_user != 'Overall':
+        df = df[df['user'] == selected_user]
+
+    links = extract_links(df['message'])
+    links['user'] = df['user'].to_numpy()[links['row']]
+    domains = links['domain'].value_counts().rename_axis('domain').reset_index(name='count')
+    users = links['user'].value_counts().rename_axis('user').reset_index(name='count')
+    return domains, users
 
 def fetch_stats(selected_user, df):
     if selected_user != 'Overall':
@@ -15,10 +163,8 @@ def fetch_stats(selected_user, df):
     words = []
     for message in df['message']:
         words.extend(message.split())
-    num_media_messages = df[df['message'] == '<Media omitted>\n'].shape[0]
-    links = []
-    for message in df['message']:
-        links.extend(extract.find_urls(message))
+    num_media_messages = df[df['message'] == MEDIA_MESSAGE].shape[0]
+    links = extract_links(df['message'])
     return num_messages, len(words), num_media_messages, len(links)
 
 def most_busy_users(df):
@@ -26,67 +172,77 @@ def most_busy_users(df):
     df_percent = round((df['user'].value_counts() / df.shape[0]) * 100, 2).reset_index().rename(columns={'count': 'percent', 'user': 'name'})
     return x, df_percent
 
-def create_wordcloud(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    
-    # Filter out media omitted and system notifications
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
-    
-    # Basic stop words
-    stop_words = ["the", "a", "is", "am", "are", "and", "or", "to", "in", "it", "i", "you", "my", "me", "was", "for", "with", "on", "this", "that", "of", "at", "but", "not", "have", "be", "as", "do", "we", "your", "can", "if", "so", "up", "all", "get", "go", "out", "now", "just", "like", "they", "will"]
-    
-    def remove_stop_words(message):
-        y = []
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
-
-    wc = WordCloud(width=500, height=500, min_font_size=10, background_color='white')
-    temp['message'] = temp['message'].apply(remove_stop_words)
-    df_wc = wc.generate(temp['message'].str.cat(sep=" "))
-    return df_wc
-
-def most_common_words(selected_user, df):
+def token_counts(messages):
+    # Lowercased whitespace tokens of all messages, counted by one C-level split
+    return Counter(" ".join(messages).lower().split())
+
+def without_stop_words(counts, stop_words=STOP_WORDS):
+    return Counter({word: count for word, count in counts.items() if word not in stop_words})
+
+def cloud_frequencies(counts):
+    # Same words WordCloud.process_text keeps (its own stop words, no bare
+    # numbers, trailing 's dropped), worked out once per distinct token, then
+    # merged by WordCloud's own case and plural normalisation. Unlike
+    # generate(), no two-word collocations are added: they depend on word
+    # order, which the token index does not keep.
+    words = Counter()
+    for token, count in counts.items():
+        for word in CLOUD_WORD_PATTERN.findall(token):
+            if word.lower().endswith("'s"):
+                word = word[:-2]
+            if word.isdigit() or word.lower() in WORDCLOUD_STOPWORDS:
+                continue
+            words[word] += count
+    _, forms = process_tokens(words)
+    frequencies = Counter()
+    for word, count in words.items():
+        frequencies[forms[word.lower()]] += count
+    return frequencies
+
+# Fixed seed for word placement and colours, so the same words always draw
+# the same image
+WORDCLOUD_RANDOM_STATE = 42
+
+def wordcloud_from_counts(counts, width=500, height=500):
+    wc = WordCloud(width=width, height=height, min_font_size=10, background_color='white', random_state=WORDCLOUD_RANDOM_STATE)
+    return wc.generate_from_frequencies(cloud_frequencies(counts))
+
+def _text_messages(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
 
+    # Filter out media omitted and system notifications
     temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
-
-    stop_words = ["the", "a", "is", "am", "are", "and", "or", "to", "in", "it", "i", "you", "my", "me", "was", "for", "with", "on", "this", "that", "of", "at", "but", "not", "have", "be", "as", "do", "we", "your", "can", "if", "so", "up", "all", "get", "go", "out", "now", "just", "like", "they", "will"]
-    words = []
+    return temp.loc[temp['message'] != MEDIA_MESSAGE, 'message']
 
-    for message in temp['message']:
-        for word in message.lower().split():
-            if word not in stop_words:
-                words.append(word)
+def create_wordcloud(selected_user, df, stop_words=STOP_WORDS):
+    counts = without_stop_words(token_counts(_text_messages(selected_user, df)), stop_words)
+    return wordcloud_from_counts(counts)
 
-    most_common_df = pd.DataFrame(Counter(words).most_common(20))
+def most_common_words(selected_user, df, stop_words=STOP_WORDS):
+    counts = without_stop_words(token_counts(_text_messages(selected_user, df)), stop_words)
+    most_common_df = pd.DataFrame(counts.most_common(20))
     return most_common_df
 
 def emoji_helper(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
 
-    emojis = []
-    for message in df['message']:
-        emojis.extend([c for c in message if c in emoji.EMOJI_DATA])
+    _, emojis = extract_emojis(df['message'])
 
-    emoji_df = pd.DataFrame(Counter(emojis).most_common(len(Counter(emojis))))
+    emoji_df = pd.DataFrame(Counter(emojis).most_common())
     return emoji_df
 
+def timeline_labels(timeline):
+    # "January-2021" style labels for a monthly timeline
+    return timeline['month'].astype(str) + "-" + timeline['year'].astype(str)
+
 def monthly_timeline(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
 
-    timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-    time = []
-    for i in range(timeline.shape[0]):
-        time.append(timeline['month'][i] + "-" + str(timeline['year'][i]))
-    timeline['time'] = time
+    timeline = df.groupby(['year', 'month_num', 'month'], observed=True).count()['message'].reset_index()
+    timeline['time'] = timeline_labels(timeline)
     return timeline
 
 def daily_timeline(selected_user, df):
@@ -96,79 +252,102 @@ def daily_timeline(selected_user, df):
     daily_timeline = df.groupby('date').count()['message'].reset_index()
     return daily_timeline
 
+# The name columns are categoricals; counted as plain names, so that ties
+# and the heatmap's rows and columns keep the order they had as strings
+
 def week_activity_map(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
-    return df['day_name'].value_counts()
+    return df['day_name'].astype(object).value_counts()
 
 def month_activity_map(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
-    return df['month'].value_counts()
+    return df['month'].astype(object).value_counts()
 
 def activity_heatmap(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
 
+    df = df.astype({'day_name': object, 'period': object})
     user_heatmap = df.pivot_table(index='day_name', columns='period', values='message', aggfunc='count').fillna(0)
     return user_heatmap
 
+def sentiment_pool():
+    global _sentiment_pool
+    with _sentiment_pool_lock:
+        if _sentiment_pool is None:
+            _sentiment_pool = ProcessPoolExecutor(
+                max_workers=SENTIMENT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _sentiment_pool
+
+def sentiment_scores(messages):
+    # Scores each distinct text once; group chats repeat short messages a lot
+    codes, uniques = pd.factorize(messages)
+    if SENTIMENT_PROCESSES > 1 and len(uniques) >= SENTIMENT_POOL_MIN_TEXTS:
+        chunksize = len(uniques) // (SENTIMENT_PROCESSES * 4) + 1
+        scores = list(sentiment_pool().map(compound_score, uniques, chunksize=chunksize))
+    else:
+        scores = [compound_score(text) for text in uniques]
+    return np.asarray(scores, dtype=float)[codes]
+
+def sentiment_labels(scores):
+    return np.select([scores >= 0.05, scores <= -0.05], ['Positive', 'Negative'], 'Neutral')
+
 def sentiment_analysis(selected_user, df):
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
     
     df = df[df['user'] != 'group_notification']
-    df = df[df['message'] != '<Media omitted>\n']
+    df = df[df['message'] != MEDIA_MESSAGE]
 
-    def get_sentiment(text):
-        return analyzer.polarity_scores(text)['compound']
+    scores = sentiment_scores(df['message'])
+    df = df[['user', 'message']].assign(sentiment=sentiment_labels(scores), sentiment_score=scores)
+    return df['sentiment'].value_counts(), df[['user', 'message', 'sentiment', 'sentiment_score']].head(10)
 
-    df['sentiment_score'] = df['message'].apply(get_sentiment)
-    
-    def get_sentiment_label(score):
-        if score >= 0.05:
-            return 'Positive'
-        elif score <= -0.05:
-            return 'Negative'
-        else:
-            return 'Neutral'
+def user_stats_table(users, dates, words, emojis, media):
+    # One groupby over per-message counts; all arguments are aligned Series.
+    # A response is a message sent right after someone else's message, and
+    # its time is the gap since that message.
+    response = dates.diff().where(users.ne(users.shift())).dt.total_seconds() / 60
+    per_message = pd.DataFrame({
+        'user': users,
+        'date': dates,
+        'day': dates.dt.normalize(),
+        'words': words,
+        'emojis': emojis,
+        'media': media,
+        'response': response,
+    })
 
-    df['sentiment'] = df['sentiment_score'].apply(get_sentiment_label)
-    return df['sentiment'].value_counts(), df[['user', 'message', 'sentiment', 'sentiment_score']].head(10)
+    user_data = per_message.groupby('user', sort=False).agg(
+        Messages=('user', 'size'),
+        Words=('words', 'sum'),
+        Emojis=('emojis', 'sum'),
+        Media=('media', 'sum'),
+        **{
+            'First Seen': ('date', 'min'),
+            'Last Seen': ('date', 'max'),
+            'Active Days': ('day', 'nunique'),
+            'Median Response (min)': ('response', 'median'),
+        }
+    ).reset_index().rename(columns={'user': 'User'})
+    user_data['Median Response (min)'] = user_data['Median Response (min)'].round(2)
+    return user_data.sort_values(by='Messages', ascending=False)
 
 def user_detailed_stats(df):
     # This function only makes sense for 'Overall' view
-    users = df[df['user'] != 'group_notification']['user'].unique()
-    user_data = []
-    
-    for user in users:
-        user_df = df[df['user'] == user]
-        num_messages = user_df.shape[0]
-        
-        # Word count
-        words = []
-        for msg in user_df['message']:
-            words.extend(msg.split())
-        num_words = len(words)
-        
-        # Emoji count
-        emojis = []
-        for msg in user_df['message']:
-            emojis.extend([c for c in msg if c in emoji.EMOJI_DATA])
-        num_emojis = len(emojis)
-        
-        # Media count
-        num_media = user_df[user_df['message'] == '<Media omitted>\n'].shape[0]
-        
-        user_data.append({
-            'User': user,
-            'Messages': num_messages,
-            'Words': num_words,
-            'Emojis': num_emojis,
-            'Media': num_media
-        })
-        
-    return pd.DataFrame(user_data).sort_values(by='Messages', ascending=False)
+    df = df[df['user'] != 'group_notification']
+    message = df['message'].astype(object, copy=False)
+    rows, _ = extract_emojis(message)
+
+    return user_stats_table(
+        df['user'],
+        df['date'],
+        message.str.split().str.len(),
+        pd.Series(np.bincount(rows, minlength=len(df)), index=df.index),
+        message == MEDIA_MESSAGE,
+    )
 
 def extra_stats(selected_user, df):
     if selected_user != 'Overall':
@@ -180,9 +359,7 @@ def extra_stats(selected_user, df):
     if df.empty:
         return 0, 0, 0, 0, 0, 0
         
-    # Deleted messages patterns (WhatsApp specific)
-    deleted_patterns = ['This message was deleted', 'You deleted this message']
-    deleted_count = df[df['message'].str.contains('|'.join(deleted_patterns), case=False)].shape[0]
+    deleted_count = df[df['message'].str.contains('|'.join(DELETED_PATTERNS), case=False)].shape[0]
     
     # Empty messages (just whitespace or truly empty)
     empty_messages = df[df['message'].str.strip() == ""].shape[0]
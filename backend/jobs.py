@@ -0,0 +1,148 @@
+import json
+import orjson
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from workers import analysis_pool
+
+# SQLite database holding job state and finished sections. The default keeps
+# jobs in memory; a file path lets them outlive a restart of the API, and
+# lets several API processes on one host share the queue.
+JOBS_DB = os.environ.get("JOBS_DB", ":memory:")
+
+# Finished jobs (and their results) are deleted after this long
+JOBS_TTL_SECONDS = int(os.environ.get("JOBS_TTL_SECONDS", 60 * 60))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    # Jobs run on the shared analysis worker pool; the database is only the
+    # record of their progress, so no separate broker or worker is needed
+
+    def __init__(self, path=JOBS_DB, ttl=JOBS_TTL_SECONDS):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, stage TEXT, "
+                "parsed INTEGER, sections TEXT, chat_id TEXT, error TEXT, created REAL, updated REAL, owner INTEGER)"
+            )
+            if "owner" not in [column[1] for column in self.db.execute("PRAGMA table_info(jobs)")]:
+                self.db.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS job_sections (job_id TEXT, section TEXT, data TEXT, "
+                "PRIMARY KEY (job_id, section))"
+            )
+
+    def recover(self):
+        # Called once at server startup
+        with self.lock, self.db:
+            # Each job runs in the process that accepted it (its pid is the
+            # owner). Jobs of processes that have stopped never finish; jobs
+            # under this process's pid are from an earlier process that had it.
+            owners = self.db.execute("SELECT DISTINCT owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            for (owner,) in owners:
+                if owner is None or owner == os.getpid() or not _alive(owner):
+                    self.db.execute(
+                        "UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart' "
+                        "WHERE status IN ('queued', 'running') AND owner IS ?",
+                        (owner,),
+                    )
+
+    def _expire(self, now):
+        expired = "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated < ?"
+        self.db.execute(f"DELETE FROM job_sections WHERE job_id IN ({expired})", (now - self.ttl,))
+        self.db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (now - self.ttl,))
+
+    def create(self, sections):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.db:
+            self._expire(now)
+            self.db.execute(
+                "INSERT INTO jobs VALUES (?, 'queued', 'queued', 0, ?, NULL, NULL, ?, ?, ?)",
+                (job_id, json.dumps(sections), now, now, os.getpid()),
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock, self.db:
+            self.db.execute(
+                f"UPDATE jobs SET {columns}, updated = ? WHERE id = ?",
+                (*fields.values(), time.time(), job_id),
+            )
+
+    def add_section(self, job_id, section, data):
+        # `data` is the section's encoded JSON
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO job_sections VALUES (?, ?, ?)",
+                (job_id, section, data.decode()),
+            )
+            self.db.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id))
+
+    def get(self, job_id, since=0):
+        # Job state plus the sections finished so far, in completion order,
+        # as encoded JSON; `since` skips the first ones for clients that
+        # already have them
+        with self.lock:
+            row = self.db.execute(
+                "SELECT status, stage, parsed, sections, chat_id, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            done = self.db.execute(
+                "SELECT section, data FROM job_sections WHERE job_id = ? ORDER BY rowid", (job_id,)
+            ).fetchall()
+
+        status, stage, parsed, sections, chat_id, error = row
+        sections = json.loads(sections)
+        state = orjson.dumps({
+            "job_id": job_id,
+            "status": status,
+            "stage": stage,
+            "progress": {
+                "parsed": parsed,
+                "sections_done": len(done),
+                "sections_total": len(sections),
+            },
+            "chat_id": chat_id,
+            "error": error,
+        })
+        # The stored sections are spliced in as they are, without decoding them
+        sections = b"{" + b",".join(orjson.dumps(section) + b":" + data.encode() for section, data in done[since:]) + b"}"
+        return state[:-1] + b',"sections":' + sections + b"}"
+
+    def _run(self, job_id, fn, args):
+        try:
+            fn(self, job_id, *args)
+            self.update(job_id, status="done", stage="done")
+        except Exception as e:
+            self.update(job_id, status="failed", error=str(getattr(e, "detail", e)))
+
+    def submit(self, sections, fn, *args):
+        # Queues fn(queue, job_id, *args) and returns the job id; raises
+        # workers.QueueFull when the pool is at its limit
+        job_id = self.create(sections)
+        try:
+            analysis_pool.submit(self._run, job_id, fn, args)
+        except Exception as e:
+            self.update(job_id, status="failed", error=str(e) or "The server is busy")
+            raise
+        return job_id
+
+
+job_queue = JobQueue()
@@ -1,6 +1,6 @@
 import streamlit as st
-import preprocessing
-import helper
+from cache import chat_cache
+from engine import STAGES
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -31,12 +31,18 @@ st.markdown("""
 st.sidebar.title("📁 WhatsApp Chat Analyzer")
 st.sidebar.markdown("---")
 
-upload_file = st.sidebar.file_uploader("Upload Chat File (.txt)", help="Export WhatsApp chat without media and upload here.")
+upload_file = st.sidebar.file_uploader("Upload Chat File (.txt, .zip or .gz)", help="Export WhatsApp chat and upload the .txt, or the .zip export as it is.")
 
 if upload_file is not None:
-    bytes_data = upload_file.getvalue()
-    data = bytes_data.decode('utf-8')
-    df = preprocessing.preprocess(data)
+    # Reruns (e.g. switching the selected user) reuse the parsed chat from the cache
+    try:
+        chat_key, engine = chat_cache.load_chat_file(upload_file)
+    except ValueError as e:
+        # Archives without a chat, damaged archives, text that is not UTF-8
+        # and exports over the size limit
+        st.error(f"Error: {e}")
+        st.stop()
+    df = engine.df
     
     # Check if df is empty
     if df.empty:
@@ -58,10 +64,12 @@ if upload_file is not None:
         selected_user = st.sidebar.selectbox("Show Analysis for", user_list)
         
         if st.sidebar.button("Show Analysis"):
+            # Every section below is shown, so compute all per-message counts in one pass
+            engine.prepare(STAGES)
             
             # --- Top Statistics ---
             st.title("📊 Statistics Overview")
-            num_messages, words, num_media_messages, num_links = helper.fetch_stats(selected_user, df)
+            num_messages, words, num_media_messages, num_links = engine.fetch_stats(selected_user)
             
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -72,6 +80,15 @@ if upload_file is not None:
                 st.metric("Media Shared", num_media_messages)
             with col4:
                 st.metric("Links Shared", num_links)
+
+            if num_links:
+                with st.expander("🔗 Links Shared"):
+                    link_domains, link_users = engine.links_shared(selected_user)
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.dataframe(link_domains, use_container_width=True)
+                    with col2:
+                        st.dataframe(link_users, use_container_width=True)
             
             st.markdown("---")
             
@@ -80,7 +97,7 @@ if upload_file is not None:
             
             # Monthly Timeline
             st.subheader("Monthly Timeline")
-            timeline = helper.monthly_timeline(selected_user, df)
+            timeline = engine.monthly_timeline(selected_user)
             fig, ax = plt.subplots(figsize=(12, 6))
             ax.plot(timeline['time'], timeline['message'], color='#25D366', marker='o', linestyle='-', linewidth=2)
             plt.xticks(rotation='vertical')
@@ -88,7 +105,7 @@ if upload_file is not None:
             
             # Daily Timeline
             st.subheader("Daily Timeline")
-            daily_timeline = helper.daily_timeline(selected_user, df)
+            daily_timeline = engine.daily_timeline(selected_user)
             fig, ax = plt.subplots(figsize=(12, 6))
             ax.plot(daily_timeline['date'], daily_timeline['message'], color='#128C7E', linewidth=1)
             plt.xticks(rotation='vertical')
@@ -102,7 +119,7 @@ if upload_file is not None:
 
             with col1:
                 st.subheader("Most Busy Day")
-                busy_day = helper.week_activity_map(selected_user, df)
+                busy_day = engine.week_activity_map(selected_user)
                 fig, ax = plt.subplots()
                 ax.bar(busy_day.index, busy_day.values, color='#075E54')
                 plt.xticks(rotation='vertical')
@@ -110,7 +127,7 @@ if upload_file is not None:
                 
             with col2:
                 st.subheader("Most Busy Month")
-                busy_month = helper.month_activity_map(selected_user, df)
+                busy_month = engine.month_activity_map(selected_user)
                 fig, ax = plt.subplots()
                 ax.bar(busy_month.index, busy_month.values, color='#34B7F1')
                 plt.xticks(rotation='vertical')
@@ -118,7 +135,7 @@ if upload_file is not None:
             
             # Activity Heatmap
             st.subheader("Weekly Activity Heatmap")
-            user_heatmap = helper.activity_heatmap(selected_user, df)
+            user_heatmap = engine.activity_heatmap(selected_user)
             fig, ax = plt.subplots(figsize=(15, 6))
             sns.heatmap(user_heatmap, ax=ax, cmap='YlGnBu')
             st.pyplot(fig)
@@ -127,7 +144,7 @@ if upload_file is not None:
             
             # --- Advanced Metrics ---
             st.title("🛡️ Message Metrics & Quality")
-            deleted_count, empty_messages, avg_chars, max_chars, avg_words, max_words = helper.extra_stats(selected_user, df)
+            deleted_count, empty_messages, avg_chars, max_chars, avg_words, max_words = engine.extra_stats(selected_user)
             
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -151,13 +168,13 @@ if upload_file is not None:
                 
                 # Detailed User Table
                 st.subheader("Message, Word, & Emoji Usage per User")
-                detailed_df = helper.user_detailed_stats(df)
+                detailed_df = engine.user_detailed_stats()
                 st.dataframe(detailed_df, use_container_width=True)
                 
                 col1, col2 = st.columns(2)
                 with col1:
                     st.subheader("Messages Shared by Top Users")
-                    x, new_df = helper.most_busy_users(df)
+                    x, new_df = engine.most_busy_users()
                     fig, ax = plt.subplots()
                     ax.bar(x.index, x.values, color='#25D366')
                     plt.xticks(rotation='vertical')
@@ -170,7 +187,7 @@ if upload_file is not None:
 
             # --- Sentiment Analysis ---
             st.title("🎭 Sentiment Analysis")
-            sentiment_counts, sample_sentiments = helper.sentiment_analysis(selected_user, df)
+            sentiment_counts, sample_sentiments = engine.sentiment_analysis(selected_user)
             
             col1, col2 = st.columns([1, 2])
             with col1:
@@ -195,7 +212,7 @@ if upload_file is not None:
             col1, col2 = st.columns(2)
             with col1:
                 st.subheader("Word Cloud")
-                df_wc = helper.create_wordcloud(selected_user, df)
+                df_wc = engine.create_wordcloud(selected_user)
                 fig, ax = plt.subplots()
                 ax.imshow(df_wc)
                 ax.axis("off")
@@ -203,7 +220,7 @@ if upload_file is not None:
             
             with col2:
                 st.subheader("Most Common Words")
-                most_common_df = helper.most_common_words(selected_user, df)
+                most_common_df = engine.most_common_words(selected_user)
                 fig, ax = plt.subplots()
                 ax.barh(most_common_df[0], most_common_df[1], color='#128C7E')
                 plt.xticks(rotation='vertical')
@@ -213,7 +230,7 @@ if upload_file is not None:
 
             # --- Emoji Analysis ---
             st.title("😀 Emoji Analysis")
-            emoji_df = helper.emoji_helper(selected_user, df)
+            emoji_df = engine.emoji_helper(selected_user)
             
             if not emoji_df.empty:
                 col1, col2 = st.columns(2)
@@ -5,28 +5,58 @@ from datetime import timedelta
 import database
 import schemas
 import auth
-import preprocessing
-import helper
-import pandas as pd
-import io
-from typing import List
+from engine import AnalysisEngine
+import analysis
+from cache import chat_cache, LimitedReader, NotContinuation
+from workers import analysis_pool, QueueFull, ClientDisconnected
+from jobs import job_queue
+import metrics
+from fastapi.concurrency import run_in_threadpool
+import shutil
+import tempfile
+from typing import List, Optional
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="WhatsApp Chat Analyzer API")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Run at startup rather than on import: spawned worker processes import
+    # this module again, and must not touch the databases
+    database.create_db_and_tables()
+    job_queue.recover()
+    yield
+
+app = FastAPI(title="WhatsApp Chat Analyzer API", lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
 
-# Logging middleware to see if requests hit the server
+# Logging middleware to see if requests hit the server. It also times the
+# request for /metrics (by route template, so ids do not multiply the series),
+# adds the Server-Timing header and profiles slow requests when enabled.
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     print(f"Incoming request: {request.method} {request.url}")
+    trace, token = metrics.start_request(request.url.path)
     try:
         response = await call_next(request)
-        print(f"Response status: {response.status_code}")
-        return response
+    except ClientDisconnected:
+        # Nobody is left to answer; Starlette still wants a response object,
+        # but it is never sent
+        print(f"Client disconnected: {request.method} {request.url}")
+        metrics.finish_request(trace, token, request.method, request_route(request), "disconnected")
+        return Response(status_code=204)
     except Exception as e:
         print(f"Request failed: {str(e)}")
+        metrics.finish_request(trace, token, request.method, request_route(request), 500)
         raise e
+    print(f"Response status: {response.status_code}")
+    metrics.finish_request(trace, token, request.method, request_route(request), response.status_code, response)
+    return response
+
+def request_route(request: Request):
+    route = request.scope.get("route")
+    return route.path if route is not None else "unmatched"
 
 origins = [
     "http://localhost:3000",
@@ -41,7 +71,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import orjson
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     return JSONResponse(
@@ -49,8 +80,14 @@ async def global_exception_handler(request, exc):
         content={"message": f"An unexpected error occurred: {str(exc)}"},
     )
 
-# Create tables on startup
-database.create_db_and_tables()
+metrics.gauge("chat_cache_bytes", "Estimated size of the cached chats and results.", lambda: chat_cache.total_bytes)
+metrics.gauge("chat_cache_entries", "Cached chats and results.", lambda: len(chat_cache.entries))
+metrics.gauge("analysis_pool_pending", "Tasks running or waiting on the analysis worker pool.", lambda: analysis_pool.pending)
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text format; left unauthenticated for the scraper
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # Dependency to get DB session
 get_db = auth.get_db
@@ -93,122 +130,312 @@ def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2Passw
     return {"access_token": access_token, "token_type": "bearer"}
 
 # Analysis Endpoints (Protected by JWT)
+# Parsing and analysis block, so they run on the worker pool and the event
+# loop stays free; the helpers below are called on a worker thread.
+
+def with_upload(fn, file: UploadFile):
+    # Pool task calling fn with the spooled upload as its first argument, for
+    # fn to read and close. A started task may outlive its request (a
+    # timeout or disconnect only cancels tasks that have not started), and
+    # Starlette closes the upload when the request ends, so the task takes
+    # the upload over as it starts and leaves an empty file in its place. A
+    # task that never starts (the pool was full, or it was cancelled) leaves
+    # the upload with the request, to be closed as usual.
+    def task(*args):
+        fileobj, file.file = file.file, tempfile.SpooledTemporaryFile()
+        return fn(fileobj, *args)
+    return task
+
+def get_engine_from_file(fileobj, date_format: Optional[str] = None):
+    # Re-uploads of the same file are served from the cache without re-parsing.
+    # The upload is spooled to disk by Starlette and parsed from there in blocks;
+    # it may be the .txt, WhatsApp's .zip export or a gzipped .txt.
+    try:
+        with fileobj:
+            return chat_cache.load_chat_file(fileobj, date_format)
+    except ValueError as e:
+        # Archives without a chat, damaged archives, text that is not UTF-8
+        # and exports over the size limit
+        raise HTTPException(status_code=400, detail=str(e))
+
+def get_chat_engine(chat_id: str):
+    engine = chat_cache.get_chat(chat_id)
+    if engine is None:
+        raise HTTPException(status_code=404, detail="Chat not found or expired. Please upload it again.")
+    return engine
+
+def get_sections(sections: Optional[str]):
+    try:
+        return analysis.parse_sections(sections)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def get_analysis(chat_id: str, engine: AnalysisEngine, selected_user: str, sections: List[str], columnar: bool = False):
+    # Sections are cached one by one, already encoded as JSON, so a later
+    # request for more of them only computes what is still missing
+    keys = {section: (chat_id, selected_user, section, columnar) for section in sections}
+    cached = {}
+    for section in sections:
+        section_data = chat_cache.get(keys[section])
+        if section_data is not None:
+            cached[section] = section_data
+
+    encoded = analysis.build_analysis(engine, selected_user, sections, cached, columnar)
+    for section in sections:
+        if section not in cached:
+            chat_cache.put(keys[section], encoded[section])
+    return encoded
+
+def analysis_response(engine: AnalysisEngine, encoded):
+    return Response(analysis.analysis_json(engine, encoded), media_type="application/json")
+
+def analyze_file(fileobj, date_format: Optional[str], selected_user: str, sections: List[str], columnar: bool):
+    chat_id, engine = get_engine_from_file(fileobj, date_format)
+    return analysis_response(engine, get_analysis(chat_id, engine, selected_user, sections, columnar))
+
+def upload_file(fileobj, date_format: Optional[str]):
+    chat_id, engine = get_engine_from_file(fileobj, date_format)
+    return {
+        "chat_id": chat_id,
+        "date_format": engine.df.attrs.get("date_format"),
+        "users": analysis.chat_users(engine)
+    }
+
+def append_file(fileobj, chat_id: str):
+    try:
+        with fileobj:
+            contents = LimitedReader(fileobj).read()
+        appended = chat_cache.append_chat(chat_id, contents)
+    except NotContinuation as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        # Text that is not UTF-8, damaged archives and exports over the size limit
+        raise HTTPException(status_code=400, detail=str(e))
+    if appended is None:
+        raise HTTPException(status_code=404, detail="Chat not found or expired. Please upload it again.")
 
-async def get_df_from_file(file: UploadFile):
-    contents = await file.read()
-    data = contents.decode("utf-8")
-    df = preprocessing.preprocess(data)
-    return df
+    new_chat_id, engine, new_messages = appended
+    return {
+        "chat_id": new_chat_id,
+        "date_format": engine.df.attrs.get("date_format"),
+        "users": analysis.chat_users(engine),
+        "new_messages": new_messages
+    }
+
+def chat_analysis(chat_id: str, selected_user: str, sections: List[str], columnar: bool):
+    engine = get_chat_engine(chat_id)
+    return analysis_response(engine, get_analysis(chat_id, engine, selected_user, sections, columnar))
+
+def chat_section(chat_id: str, selected_user: str, section: str, columnar: bool):
+    return get_analysis(chat_id, get_chat_engine(chat_id), selected_user, [section], columnar)[section]
+
+def wordcloud_image(chat_id: str, selected_user: str, size: int, extra_stop_words: tuple):
+    try:
+        return analysis.wordcloud_png(get_chat_engine(chat_id), selected_user, size, extra_stop_words)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="No words to draw a word cloud from")
+
+async def run_in_pool(request: Request, fn, *args):
+    try:
+        return await analysis_pool.run(request, fn, *args)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="The server is busy. Please try again shortly.", headers={"Retry-After": "5"})
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="The analysis took too long. Please try again later.")
+
+# Streaming mode: each section is sent as soon as it is computed, cheapest
+# first, as newline delimited JSON or as server-sent events
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def get_stream_format(stream: Optional[str]):
+    if stream is not None and stream not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Stream must be one of {', '.join(STREAM_MEDIA_TYPES)}")
+    return stream
+
+def stream_event(stream: str, event: str, data: bytes):
+    # `data` is already encoded JSON; orjson never writes a newline in it
+    if stream == "sse":
+        return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+    return analysis.json_object([("event", orjson.dumps(event)), ("data", data)]) + b"\n"
+
+def section_data(chat_id: str, engine: AnalysisEngine, selected_user: str, section: str, columnar: bool):
+    return get_analysis(chat_id, engine, selected_user, [section], columnar)[section]
+
+def stream_analysis(request: Request, stream: str, chat_id: str, engine: AnalysisEngine, selected_user: str, sections: List[str], columnar: bool = False):
+    # Events: "meta" first, then one per section named after it, then "done"
+    # (or "error", after which nothing more is sent)
+    async def events():
+        yield stream_event(stream, "meta", orjson.dumps({
+            "chat_id": chat_id,
+            "date_format": engine.df.attrs.get("date_format"),
+            "sections": analysis.stream_order(sections),
+        }))
+        for section in analysis.stream_order(sections):
+            try:
+                data = await run_in_pool(request, section_data, chat_id, engine, selected_user, section, columnar)
+            except HTTPException as e:
+                yield stream_event(stream, "error", orjson.dumps({"section": section, "status": e.status_code, "detail": e.detail}))
+                return
+            except ClientDisconnected:
+                print(f"Client disconnected: {request.method} {request.url}")
+                return
+            except Exception as e:
+                # The 200 status is already sent, so the failure can only be
+                # reported in the stream
+                print(f"Section {section} failed: {e}")
+                yield stream_event(stream, "error", orjson.dumps({"section": section, "status": 500, "detail": str(e)}))
+                return
+            yield stream_event(stream, section, data)
+        yield stream_event(stream, "done", orjson.dumps({
+            "skipped_sections": [section for section in analysis.SECTIONS if section not in sections]
+        }))
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type=STREAM_MEDIA_TYPES[stream], headers=headers)
 
 @app.post("/analyze")
 async def analyze_chat(
+    request: Request,
     file: UploadFile = File(...),
     selected_user: str = Form("Overall"),
+    date_format: Optional[str] = Form(None),
+    sections: Optional[str] = Form(None),
+    stream: Optional[str] = Form(None),
+    columnar: bool = Form(False),
     current_user: database.User = Depends(auth.get_current_user)
 ):
-    import base64
-    df = await get_df_from_file(file)
-    
-    # 1. Stats
-    num_messages, words, num_media, num_links = helper.fetch_stats(selected_user, df)
-    
-    # 2. Busiest Users
-    x, busy_users_df = helper.most_busy_users(df)
-    
-    # 3. WordCloud
-    df_wc = helper.create_wordcloud(selected_user, df)
-    img_buffer = io.BytesIO()
-    df_wc.to_image().save(img_buffer, format='PNG')
-    wordcloud_img = base64.b64encode(img_buffer.getvalue()).decode()
-    
-    # 4. Emojis
-    emoji_df = helper.emoji_helper(selected_user, df)
-    
-    # 5. Timeline
-    timeline = helper.monthly_timeline(selected_user, df)
-    
-    # 6. Activity Map
-    busy_day = helper.week_activity_map(selected_user, df)
-    busy_month = helper.month_activity_map(selected_user, df)
-
-    # 7. Daily Timeline (New)
-    daily_timeline = helper.daily_timeline(selected_user, df)
-
-    # 8. Activity Heatmap (New)
-    heatmap = helper.activity_heatmap(selected_user, df)
-    # Convert pivot table to easy JSON format (e.g. list of records or custom dict)
-    # Heatmap returns a pivot table (DataFrame). to_dict() might need robust handling for frontend.
-    # Let's convert it to a structure: {day: {period: count}}
-    heatmap_data = heatmap.to_dict()
-
-    # 9. Sentiment Analysis (New)
-    sentiment_counts, sentiment_samples = helper.sentiment_analysis(selected_user, df)
-    
-    # 10. User Detailed Stats (New)
-    # user_detailed_stats takes only df, usually for Overall. If selected_user is specific, it might just return that user or all.
-    # helper.py line 140 says: "This function only makes sense for 'Overall' view"
-    if selected_user == 'Overall':
-        user_stats_df = helper.user_detailed_stats(df)
-        user_stats = user_stats_df.to_dict(orient="records")
-    else:
-        user_stats = []
-
-    # 11. Extra Stats (New)
-    deleted_count, empty_messages, avg_msg_len, max_msg_len, avg_word_count, max_word_count = helper.extra_stats(selected_user, df)
-    
-    import numpy as np
-
-    def convert_numpy(obj):
-        if isinstance(obj, (np.intc, np.intp, np.int8,
-                            np.int16, np.int32, np.int64, np.uint8,
-                            np.uint16, np.uint32, np.uint64)):
-            return int(obj)
-        elif isinstance(obj, (np.float16, np.float32, np.float64)):
-            return float(obj)
-        elif isinstance(obj, (np.ndarray,)): 
-            return obj.tolist()
-        elif isinstance(obj, dict):
-            return {k: convert_numpy(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_numpy(i) for i in obj]
-        return obj
-
-    response_data = {
-        "stats": {
-            "num_messages": num_messages,
-            "num_words": words,
-            "num_media": num_media,
-            "num_links": num_links
-        },
-        "busiest_users": {
-            "top_users": x.to_dict(),
-            "percentages": busy_users_df.to_dict(orient="records")
-        },
-        "wordcloud": f"data:image/png;base64,{wordcloud_img}",
-        "emojis": emoji_df.to_dict(orient="records"),
-        "timeline": timeline.to_dict(orient="records"),
-        "activity_map": {
-            "busy_day": busy_day.to_dict(),
-            "busy_month": busy_month.to_dict()
-        },
-        "daily_timeline": daily_timeline.to_dict(orient="records"),
-        "activity_heatmap": heatmap_data,
-        "sentiment": {
-            "counts": sentiment_counts.to_dict(),
-            "samples": sentiment_samples.to_dict(orient="records")
-        },
-        "user_detailed_stats": user_stats,
-        "extra_stats": {
-            "deleted_messages": deleted_count,
-            "empty_messages": empty_messages,
-            "avg_msg_length": avg_msg_len,
-            "max_msg_length": max_msg_len,
-            "avg_word_count": avg_word_count,
-            "max_word_count": max_word_count
-        }
-    }
-    
-    return convert_numpy(response_data)
+    # columnar: tables come as one array per column instead of a list of records
+    requested = get_sections(sections)
+    if get_stream_format(stream):
+        # The upload is parsed before streaming starts, while it is still open
+        chat_id, engine = await run_in_pool(request, with_upload(get_engine_from_file, file), date_format)
+        return stream_analysis(request, stream, chat_id, engine, selected_user, requested, columnar)
+    return await run_in_pool(request, with_upload(analyze_file, file), date_format, selected_user, requested, columnar)
+
+# Upload-once session API: the chat is parsed on upload and later requests
+# only send its id, which stays valid until the cache expires or evicts it
+
+@app.post("/chats")
+async def upload_chat(
+    request: Request,
+    file: UploadFile = File(...),
+    date_format: Optional[str] = Form(None),
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    return await run_in_pool(request, with_upload(upload_file, file), date_format)
+
+@app.post("/chats/{chat_id}/append")
+async def append_chat(
+    chat_id: str,
+    request: Request,
+    file: UploadFile = File(...),
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    # A newer export of an uploaded chat; only the messages after the stored
+    # ones are parsed and analysed, and the result gets its own chat id
+    return await run_in_pool(request, with_upload(append_file, file), chat_id)
+
+# Job API: large chats are analysed in the background. Submitting returns a
+# job id right away; polling the job reports parse progress and returns the
+# sections as they finish.
+
+def run_analysis_job(queue, job_id: str, fileobj, date_format: Optional[str], selected_user: str, sections: List[str], columnar: bool):
+    with fileobj:
+        queue.update(job_id, status="running", stage="parsing")
+        report = lambda fraction: queue.update(job_id, parsed=int(fraction * 100))
+        chat_id, engine = chat_cache.load_chat_file(fileobj, date_format, progress=report)
+    queue.update(job_id, stage="analysing", parsed=100, chat_id=chat_id)
+    for section in sections:
+        queue.add_section(job_id, section, section_data(chat_id, engine, selected_user, section, columnar))
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    selected_user: str = Form("Overall"),
+    date_format: Optional[str] = Form(None),
+    sections: Optional[str] = Form(None),
+    columnar: bool = Form(False),
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    requested = [section for section in analysis.SECTIONS if section in get_sections(sections)]
+    # The upload is closed once this request ends, so the job gets its own copy
+    fileobj = tempfile.TemporaryFile()
+    await run_in_threadpool(shutil.copyfileobj, file.file, fileobj)
+    fileobj.seek(0)
+    try:
+        job_id = job_queue.submit(requested, run_analysis_job, fileobj, date_format, selected_user, requested, columnar)
+    except QueueFull:
+        fileobj.close()
+        raise HTTPException(status_code=503, detail="The server is busy. Please try again shortly.", headers={"Retry-After": "5"})
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def get_job(
+    job_id: str,
+    since: int = 0,
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    job = job_queue.get(job_id, since)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return Response(job, media_type="application/json")
+
+@app.get("/chats/{chat_id}/analysis")
+async def get_chat_analysis(
+    chat_id: str,
+    request: Request,
+    selected_user: str = "Overall",
+    sections: Optional[str] = None,
+    stream: Optional[str] = None,
+    columnar: bool = False,
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    requested = get_sections(sections)
+    if get_stream_format(stream):
+        engine = await run_in_pool(request, get_chat_engine, chat_id)
+        return stream_analysis(request, stream, chat_id, engine, selected_user, requested, columnar)
+    return await run_in_pool(request, chat_analysis, chat_id, selected_user, requested, columnar)
+
+@app.get("/chats/{chat_id}/wordcloud.png")
+async def get_chat_wordcloud(
+    chat_id: str,
+    request: Request,
+    selected_user: str = "Overall",
+    size: int = 500,
+    stop_words: Optional[str] = None,
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    # Rendered images share the chat cache's LRU. The ETag covers every input
+    # of the (seeded) rendering, so an unchanged one means an unchanged image;
+    # it is only answered with 304 while the chat is still there.
+    if size not in analysis.WORDCLOUD_SIZES:
+        raise HTTPException(status_code=400, detail=f"Size must be one of {analysis.WORDCLOUD_SIZES}")
+    extra_stop_words = analysis.stop_word_config(stop_words)
+    key = (chat_id, selected_user, "wordcloud.png", extra_stop_words, size)
+    headers = {"ETag": analysis.wordcloud_etag(chat_id, selected_user, size, extra_stop_words), "Cache-Control": "private, no-cache"}
+    await run_in_pool(request, get_chat_engine, chat_id)
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    png = chat_cache.get(key)
+    if png is None:
+        png = await run_in_pool(request, wordcloud_image, chat_id, selected_user, size, extra_stop_words)
+        chat_cache.put(key, png)
+    return Response(png, media_type="image/png", headers=headers)
+
+@app.get("/chats/{chat_id}/{section}")
+async def get_chat_section(
+    chat_id: str,
+    section: str,
+    request: Request,
+    selected_user: str = "Overall",
+    columnar: bool = False,
+    current_user: database.User = Depends(auth.get_current_user)
+):
+    if section not in analysis.SECTIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown section '{section}'")
+    data = await run_in_pool(request, chat_section, chat_id, selected_user, section, columnar)
+    return Response(data, media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
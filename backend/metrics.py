@@ -0,0 +1,229 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Adds a Server-Timing header with the stage timings to each API response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+
+# Requests slower than this many seconds have a stack sampling profile
+# written to PROFILE_DIR; 0 turns the profiler off. While it is on, the
+# worker threads of every request but /metrics scrapes are sampled, slow or
+# not. The event loop's thread is shared by all requests, so it is not.
+PROFILE_SLOW_REQUESTS_SECONDS = float(os.environ.get("PROFILE_SLOW_REQUESTS_SECONDS", 0))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_SECONDS", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+
+def _labels(names, values):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+class Metric:
+    # A counter or histogram in Prometheus' text format, one series per
+    # tuple of label values
+
+    def __init__(self, name, kind, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, values=(), amount=1):
+        with self.lock:
+            self.series[values] = self.series.get(values, 0) + amount
+
+    def observe(self, values, amount):
+        with self.lock:
+            counts = self.series.get(values)
+            if counts is None:
+                counts = self.series[values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    counts[i] += 1
+            counts[-2] += amount
+            counts[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series = sorted(self.series.items())
+        for values, value in series:
+            labels = _labels(self.labels, values)
+            if self.kind == "counter":
+                lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+                continue
+            prefix = labels + "," if labels else ""
+            for bound, count in zip((*self.buckets, "+Inf"), (*value[:-2], value[-1])):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {value[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {value[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Metric("chat_stage_duration_seconds", "histogram", "Time spent in each parsing and analysis stage.", ("stage",))
+PARSED_BYTES = Metric("chat_parsed_bytes_total", "counter", "Bytes of chat exports parsed.")
+PARSED_MESSAGES = Metric("chat_parsed_messages_total", "counter", "Messages parsed from chat exports.")
+REQUESTS = Metric("http_requests_total", "counter", "HTTP requests handled.", ("method", "route", "status"))
+REQUEST_SECONDS = Metric("http_request_duration_seconds", "histogram", "Time until the response headers were ready.", ("method", "route"))
+METRICS = [STAGE_SECONDS, PARSED_BYTES, PARSED_MESSAGES, REQUESTS, REQUEST_SECONDS]
+
+# Gauges read when /metrics is scraped: name -> (help, function)
+GAUGES = {}
+
+
+def gauge(name, help, fn):
+    GAUGES[name] = (help, fn)
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, (help, fn) in GAUGES.items():
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {fn()}"])
+    return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    # Spans recorded while handling one request, and the worker threads
+    # currently working on it
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.parsed = None
+        self.threads = set()
+        self.sampler = None
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe((stage,), elapsed)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append((stage, elapsed))
+
+
+def parsed(nbytes, messages):
+    # Rows per second is chat_parsed_messages_total over the "preprocess"
+    # stage time
+    PARSED_BYTES.inc((), nbytes)
+    PARSED_MESSAGES.inc((), messages)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.parsed = (nbytes, messages)
+
+
+def traced(fn, *args):
+    # Runs fn on a worker thread on behalf of the request whose context it
+    # was submitted from
+    trace = current_trace.get()
+    if trace is None:
+        return fn(*args)
+    ident = threading.get_ident()
+    trace.threads.add(ident)
+    try:
+        return fn(*args)
+    finally:
+        trace.threads.discard(ident)
+
+
+class StackSampler:
+    # Samples the Python stacks of a set of threads every `interval` seconds
+    # until stopped, as collapsed stacks ("outer;inner count", the input of
+    # flame graph tools). The set may grow while it runs.
+
+    def __init__(self, threads, interval=PROFILE_INTERVAL_SECONDS):
+        self.threads = threads
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.samples
+
+
+def start_request(path):
+    trace = RequestTrace()
+    if PROFILE_SLOW_REQUESTS_SECONDS > 0 and path != "/metrics":
+        trace.sampler = StackSampler(trace.threads)
+    return trace, current_trace.set(trace)
+
+
+def server_timing(trace, total):
+    # Spans of the same stage are summed; stages nest, so they overlap
+    durations = {}
+    for stage, elapsed in trace.spans:
+        durations[stage] = durations.get(stage, 0) + elapsed
+    entries = []
+    for stage, elapsed in durations.items():
+        entry = f"{stage};dur={elapsed * 1000:.1f}"
+        if stage == "preprocess" and trace.parsed is not None:
+            nbytes, messages = trace.parsed
+            entry += f';desc="{messages} rows, {nbytes} bytes, {messages / max(elapsed, 1e-9):.0f} rows/s"'
+        entries.append(entry)
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def write_profile(samples, method, route, total):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{route.strip('/').replace('/', '_') or 'root'}-{int(total * 1000)}ms.txt"
+    path = os.path.join(PROFILE_DIR, "".join(c if c.isalnum() or c in "-_." else "_" for c in name))
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def finish_request(trace, token, method, route, status, response=None):
+    # Records the request's metrics and, when enabled, adds Server-Timing to
+    # the response and writes the profile of a slow request. Work a response
+    # still does while its body streams is not included.
+    current_trace.reset(token)
+    total = time.perf_counter() - trace.started
+    REQUESTS.inc((method, route, str(status)))
+    REQUEST_SECONDS.observe((method, route), total)
+    if response is not None and SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(trace, total)
+    if trace.sampler is not None:
+        samples = trace.sampler.stop()
+        if total >= PROFILE_SLOW_REQUESTS_SECONDS and samples:
+            path = write_profile(samples, method, route, total)
+            print(f"Slow request profile ({total:.2f}s): {path}")
@@ -1,87 +1,268 @@
+import codecs
+import itertools
 import re
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import metrics
 
-def preprocess(data):
-    # Expanded pattern to handle various WhatsApp export formats
-    patterns = [
-        r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s?(?:am|pm|AM|PM)?\s-\s',  # 24/12/2022, 10:30 am - 
-        r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s',                    # 24/12/2022, 10:30 - 
-        r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\]\s'             # [24/12/2022, 10:30:15] 
-    ]
-    
-    pattern = '|'.join(patterns)
-    
-    messages = re.split(pattern, data)[1:]
-    dates = re.findall(pattern, data)
-    
-    # Clean up dates
-    dates = [d.replace('\u202f', ' ').strip(' -[]') for d in dates]
-    
-    df = pd.DataFrame({'user_messages': messages, 'message_date': dates})
-    
-    # Try multiple date formats
-    date_formats = [
-        '%d/%m/%Y, %I:%M %p', 
-        '%d/%m/%y, %I:%M %p',
-        '%d/%m/%Y, %H:%M',
-        '%d/%m/%y, %H:%M',
-        '%m/%d/%Y, %I:%M %p',
-        '%m/%d/%y, %I:%M %p'
-    ]
-    
-    df['date'] = None
-    for fmt in date_formats:
-        try:
-            df['date'] = pd.to_datetime(df['message_date'], format=fmt)
-            if not df['date'].isnull().all():
+# Expanded pattern to handle various WhatsApp export formats
+patterns = [
+    r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s?(?:am|pm|AM|PM)?\s-\s',  # 24/12/2022, 10:30 am -
+    r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s',                    # 24/12/2022, 10:30 -
+    r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\]\s'             # [24/12/2022, 10:30:15]
+]
+
+DATE_PATTERN = re.compile('|'.join(patterns))
+USER_PATTERN = re.compile(r'([\w\W]+?):\s')
+
+# Longest possible timestamp header; a match starting closer than this to the
+# end of the buffer may still grow once the next chunk arrives.
+MAX_HEADER_LEN = 40
+
+
+# Candidate formats in order of preference; the first six are the Android
+# dialects, the rest cover 24h month-first and iOS exports with seconds.
+DATE_FORMATS = [
+    '%d/%m/%Y, %I:%M %p',
+    '%d/%m/%y, %I:%M %p',
+    '%d/%m/%Y, %H:%M',
+    '%d/%m/%y, %H:%M',
+    '%m/%d/%Y, %I:%M %p',
+    '%m/%d/%y, %I:%M %p',
+    '%m/%d/%Y, %H:%M',
+    '%m/%d/%y, %H:%M',
+    '%d/%m/%Y, %H:%M:%S',
+    '%d/%m/%y, %H:%M:%S',
+    '%m/%d/%Y, %H:%M:%S',
+    '%m/%d/%y, %H:%M:%S'
+]
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Hour buckets used by the activity heatmap (e.g., 23-00), indexed by hour
+PERIODS = ['00-1'] + [str(hour) + "-" + str(hour + 1) for hour in range(1, 23)] + ['23-00']
+
+# Number of timestamp headers inspected to pick the date format
+DETECT_SAMPLE_SIZE = 500
+
+# Messages split into fields at a time; only that many raw records are held
+# at once, next to the columns of the chat built so far
+FRAME_RECORDS = 10000
+
+# Trailing messages of a stored chat that a newer export has to repeat
+# (same timestamp, user and text) to be appended to it
+OVERLAP_MESSAGES = 5
+
+
+def decode_chunks(blocks, encoding='utf-8'):
+    # Decodes byte blocks one at a time; characters split across two blocks
+    # are held back by the incremental decoder until the next one arrives
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for block in blocks:
+        yield decoder.decode(block)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_records(chunks):
+    # Walks the export once and yields (raw_date, raw_message) pairs exactly
+    # as re.split/re.findall would, carrying partial messages across chunks.
+    # Text before the first timestamp header is dropped.
+    buffer = ''
+    date = None
+    for chunk in chunks:
+        buffer += chunk
+        end = 0
+        safe = len(buffer) - MAX_HEADER_LEN
+        for match in DATE_PATTERN.finditer(buffer):
+            if match.start() >= safe:
                 break
-        except:
-            continue
-            
-    if df['date'].isnull().all():
-        # Fallback to automatic parsing if specific formats fail
-        df['date'] = pd.to_datetime(df['message_date'], errors='coerce')
+            if date is not None:
+                yield date, buffer[end:match.start()]
+            date = match.group()
+            end = match.end()
+        if date is None:
+            end = max(end, safe)
+        buffer = buffer[end:]
 
-    df.drop(columns=['message_date'], inplace=True)
-    
-    # Filter out non-English messages if requested (keeping the original filter logic but more explicit)
-    # df = df[~df['user_messages'].str.contains(r'[\u0600-\u06FF]', na=False)]
-    
+    end = 0
+    for match in DATE_PATTERN.finditer(buffer):
+        if date is not None:
+            yield date, buffer[end:match.start()]
+        date = match.group()
+        end = match.end()
+    if date is not None:
+        yield date, buffer[end:]
+
+
+def parse_records(records):
+    dates = []
     users = []
     messages = []
 
-    for message in df['user_messages']:
-        entry = re.split(r'([\w\W]+?):\s', message, maxsplit=1)
-        if len(entry) >= 3:
-            users.append(entry[1])
-            messages.append(entry[2])
+    for date, message in records:
+        dates.append(date.replace('\u202f', ' ').strip(' -[]'))
+        entry = USER_PATTERN.match(message)
+        if entry:
+            users.append(entry.group(1))
+            messages.append(message[entry.end():])
         else:
             users.append('group_notification')
-            messages.append(entry[0])
-            
-    df['user'] = users
-    df['message'] = messages
-    df.drop(columns=['user_messages'], inplace=True)
-    
-    # Feature extraction
-    df['year'] = df['date'].dt.year
-    df['month'] = df['date'].dt.month_name()
-    df['month_num'] = df['date'].dt.month
-    df['day_name'] = df['date'].dt.day_name()
-    df['day'] = df['date'].dt.day
-    df['hour'] = df['date'].dt.hour
-    df['minute'] = df['date'].dt.minute
-    
+            messages.append(message)
+
+    return dates, users, messages
+
+
+def detect_date_format(message_date, sample_size=DETECT_SAMPLE_SIZE):
+    # Evenly spaced sample so that a day > 12 anywhere in the chat can
+    # settle dd/mm vs mm/dd, not just in its first few messages
+    if message_date.empty:
+        return None
+    step = max(len(message_date) // sample_size, 1)
+    sample = message_date.iloc[::step]
+
+    for fmt in DATE_FORMATS:
+        try:
+            pd.to_datetime(sample, format=fmt)
+            return fmt
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+def parse_dates(message_date, date_format=None, pieces=None):
+    # Returns the parsed column and the format that was used (None when the
+    # column had to be inferred element by element). `pieces`, if given, are
+    # the same column split in consecutive parts; a format is then applied
+    # to one part at a time, so only that part is ever converted to Python
+    # strings on the way.
+    if date_format is None:
+        date_format = detect_date_format(message_date)
+
+    if date_format is not None:
+        candidates = [date_format] + [fmt for fmt in DATE_FORMATS if fmt != date_format]
+        for fmt in candidates:
+            try:
+                if pieces is None:
+                    return pd.to_datetime(message_date, format=fmt), fmt
+                return pd.concat([pd.to_datetime(piece, format=fmt) for piece in pieces], ignore_index=True), fmt
+            except (ValueError, TypeError):
+                continue
+
+    # Fallback to automatic parsing if specific formats fail
+    return pd.to_datetime(message_date, errors='coerce'), None
+
+
+def preprocess(data, date_format=None, frame_records=FRAME_RECORDS):
+    # data may be the whole export as a string or any iterable of text chunks
+    # (e.g. an open file handle, which yields it line by line). Records are
+    # split into fields frame_records at a time, so no column of the whole
+    # chat is ever a list of Python strings: timestamps and messages become
+    # Arrow string chunks, users codes into the chat's list of names. The
+    # timestamps are parsed once at the end, so the format is detected on a
+    # sample of the whole chat and applies to all of it, exactly as when the
+    # export is parsed in one go. Messages stay in Arrow memory, as they do
+    # when a stored chat is loaded (see cache.ARROW_TYPES).
+    chunks = (data,) if isinstance(data, str) else data
+    records = iter_records(chunks)
+    raw_dates, messages, user_codes = [], [], []
+    user_index = {}
+    while True:
+        with metrics.span("split"):
+            batch = list(itertools.islice(records, frame_records))
+        if not batch:
+            break
+        with metrics.span("fields"):
+            batch_dates, batch_users, batch_messages = parse_records(batch)
+            raw_dates.append(pa.array(batch_dates, type=pa.string()))
+            messages.append(pa.array(batch_messages, type=pa.string()))
+            user_codes.append(np.fromiter((user_index.setdefault(user, len(user_index)) for user in batch_users), dtype=np.int32, count=len(batch_users)))
+
+    with metrics.span("dates"):
+        pieces = [pd.Series(pd.arrays.ArrowStringArray(chunk)) for chunk in raw_dates]
+        raw_dates = pd.Series(pd.arrays.ArrowStringArray(pa.chunked_array(raw_dates, type=pa.string())))
+        date, date_format = parse_dates(raw_dates, date_format, pieces)
+
+    df = pd.DataFrame({'date': date})
+    codes = np.concatenate(user_codes) if user_codes else np.empty(0, dtype=np.int32)
+    df['user'] = np.array(list(user_index), dtype=object)[codes] if user_index else np.empty(0, dtype=object)
+    df['message'] = pd.arrays.ArrowExtensionArray(pa.chunked_array(messages, type=pa.string()))
+
+    # Lets callers skip detection when the same chat is uploaded again
+    df.attrs['date_format'] = date_format
+
+    # Filter out non-English messages if requested (keeping the original filter logic but more explicit)
+    # df = df[~df['user_messages'].str.contains(r'[\u0600-\u06FF]', na=False)]
+
+    with metrics.span("features"):
+        return add_features(df)
+
+
+def _same_dates(dates, parsed, date_format):
+    # Without a known format the stored dates were inferred element by
+    # element and cannot be reproduced, so only the text is compared
+    if date_format is None:
+        return True
+    date, _ = parse_dates(pd.Series(dates, dtype=object), date_format)
+    known = parsed.notna().to_numpy()
+    return bool((date.to_numpy()[known] == parsed.to_numpy()[known]).all())
+
+
+def find_new_messages(text, df, overlap=OVERLAP_MESSAGES):
+    # Returns the part of a newer export of the chat in `df` that follows its
+    # last messages, or None if the export does not contain them. Candidates
+    # are found by searching backwards for the last message, so the cost
+    # grows with the new tail rather than with the whole export.
+    if df.empty:
+        return text
+
+    last = df.iloc[-overlap:]
+    message = last['message'].iloc[-1]
+    window = int(last['message'].str.len().sum() + last['user'].str.len().sum()) + (len(last) + 1) * MAX_HEADER_LEN
+    end = len(text)
+    while True:
+        pos = text.rfind(message, 0, end)
+        if pos < 0:
+            return None
+        stop = pos + len(message)
+
+        records = list(iter_records((text[max(stop - window, 0):stop],)))[-len(last):]
+        if len(records) == len(last):
+            dates, users, messages = parse_records(records)
+            if users == last['user'].tolist() and messages == last['message'].tolist() and _same_dates(dates, last['date'], df.attrs.get('date_format')):
+                return text[stop:]
+        end = stop - 1
+
+
+def _small_int(values, dtype):
+    # Falls back to the nullable dtype when unparsed dates left NaNs behind
+    if values.isnull().any():
+        return values.astype(dtype.capitalize())
+    return values.astype(dtype)
+
+
+def _categorical(codes, categories):
+    codes = codes.fillna(-1).astype('int8')
+    return pd.Categorical.from_codes(codes, categories=categories, ordered=True)
+
+
+def add_features(df):
+    # All derived columns come straight from the datetime64 values; names are
+    # stored as categoricals and the numeric parts in the smallest int dtype
+    dt = df['date'].dt
+    month_num = dt.month
+
+    df['year'] = _small_int(dt.year, 'int16')
+    df['month'] = _categorical(month_num - 1, MONTH_NAMES)
+    df['month_num'] = _small_int(month_num, 'int8')
+    df['day_name'] = _categorical(dt.dayofweek, DAY_NAMES)
+    df['day'] = _small_int(dt.day, 'int8')
+    df['hour'] = _small_int(dt.hour, 'int8')
+    df['minute'] = _small_int(dt.minute, 'int8')
+
     # Adding period (e.g., 23-00)
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
-        else:
-            period.append(str(hour) + "-" + str(hour + 1))
+    df['period'] = _categorical(dt.hour, PERIODS)
 
-    df['period'] = period
-    
     return df
@@ -0,0 +1,9 @@
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+# Scoring for the sentiment worker processes. Kept apart from helper so a
+# worker only loads vader to score a message, not the rest of the backend.
+analyzer = SentimentIntensityAnalyzer()
+
+
+def compound_score(text):
+    return analyzer.polarity_scores(text)['compound']
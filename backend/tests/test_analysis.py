@@ -0,0 +1,20 @@
+import orjson
+import analysis
+import preprocessing
+from engine import AnalysisEngine
+
+CHAT = (
+    "01/02/2020, 10:00 - Alice: hello there friends\n"
+    "01/02/2020, 10:05 - Bob: <Media omitted>\n"
+    "01/02/2020, 10:06 - Alice added Carol\n"
+) * 5
+
+
+def test_wordcloud_without_words():
+    engine = AnalysisEngine(preprocessing.preprocess(CHAT))
+    assert analysis.wordcloud(engine, "Alice").startswith("data:image/png;base64,")
+    for user in ("Bob", "Nobody"):
+        encoded = analysis.build_analysis(engine, user)
+        assert set(encoded) == set(analysis.SECTIONS)
+        assert orjson.loads(encoded["wordcloud"]) is None
+        assert orjson.loads(encoded["wordcloud_words"]) == []
@@ -0,0 +1,42 @@
+import gzip
+import io
+import json
+import os
+import zipfile
+import batch
+
+
+def chat(name):
+    return "".join(f"01/02/2020, 10:{minute:02d} - {name}: message {minute}\n" for minute in range(30))
+
+
+def export_zip(text):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("WhatsApp Chat with Dave.txt", text)
+        zf.writestr("notes.txt", "an attachment, not a chat\n" * 100)
+    return buffer.getvalue()
+
+
+def test_source_zip_of_exports(tmp_path):
+    source = tmp_path / "exports.zip"
+    with zipfile.ZipFile(source, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in ("alice", "bob", "carol"):
+            zf.writestr(f"{name}.txt", chat(name.title()))
+        zf.writestr("erin.txt.gz", gzip.compress(chat("Erin").encode()))
+        zf.writestr("dave.zip", export_zip(chat("Dave")))
+        zf.writestr("photos/", "")
+
+    names = [name for name, _, _ in batch.find_chats(str(source))]
+    assert names == ["alice.txt", "bob.txt", "carol.txt", "dave.zip/WhatsApp Chat with Dave.txt", "erin.txt.gz"]
+
+    output = tmp_path / "results"
+    assert batch.run_batch(str(source), str(output), workers=1, sections=["stats"], log=io.StringIO()) == 0
+    with open(os.path.join(output, "summary.json"), "rb") as f:
+        summary = json.load(f)
+    assert len(summary) == 5 and all(row["messages"] == 30 for row in summary)
+
+
+def test_directory_zip_is_one_export(tmp_path):
+    (tmp_path / "dave.zip").write_bytes(export_zip(chat("Dave")))
+    assert [name for name, _, _ in batch.find_chats(str(tmp_path))] == ["dave.zip/WhatsApp Chat with Dave.txt"]
@@ -0,0 +1,112 @@
+import gzip
+import io
+import pandas as pd
+import pytest
+import analysis
+import preprocessing
+from cache import ChatCache, LimitedReader, NotContinuation, content_hash, open_export, read_blocks, sizeof
+from engine import AnalysisEngine
+
+TEXT = b"01/02/2020, 10:00 - Alice: hi\n" * 1000
+
+RECORDS = [
+    f"{day:02d}/0{month}/2021, {hour:02d}:{day:02d} - {user}: {message}\n"
+    for month in (1, 2)
+    for day in range(1, 29, 3)
+    for hour, user, message in (
+        (9, "Alice", "good morning \U0001F600 see https://example.com/a"),
+        (13, "Bob", "<Media omitted>"),
+        (22, "Carol", "terrible news\nsecond line"),
+    )
+]
+CHAT = "".join(RECORDS).encode()
+
+
+def assert_same_analysis(engine, expected):
+    for user in ("Overall", "Alice", "Carol"):
+        assert analysis.build_analysis(engine, user) == analysis.build_analysis(expected, user)
+
+
+def test_export_over_limit_is_rejected():
+    export = open_export(io.BytesIO(gzip.compress(TEXT)))
+    export.limit = len(TEXT)
+    assert b"".join(read_blocks(export, 4096)) == TEXT
+
+    export = open_export(io.BytesIO(gzip.compress(TEXT)))
+    export.limit = len(TEXT) - 1
+    with pytest.raises(ValueError):
+        b"".join(read_blocks(export, 4096))
+    with pytest.raises(ValueError):
+        LimitedReader(io.BytesIO(TEXT), len(TEXT) - 1).read()
+
+
+def test_date_format_of_cached_chat_reuses_its_key():
+    chat_cache = ChatCache(cache_dir=None)
+    key, engine = chat_cache.load_chat(TEXT)
+    assert engine.df.attrs["date_format"] == "%d/%m/%Y, %H:%M"
+    assert chat_cache.load_chat(TEXT, "%d/%m/%Y, %H:%M") == (key, engine)
+    assert len(chat_cache.entries) == 1
+
+    other_key, other = chat_cache.load_chat(TEXT, "%m/%d/%Y, %H:%M")
+    assert other_key.startswith(key + "-") and other is not engine
+    assert other.df["date"].iloc[0].month == 1
+
+
+def test_sizeof_counts_user_stats():
+    engine = AnalysisEngine(preprocessing.preprocess(TEXT.decode() + "02/02/2020, 11:00 - Bob: hello\n" * 1000))
+    engine.prepare(("tokens", "emojis", "links"))
+    before = sizeof(engine)
+    engine.user_detailed_stats()
+    stats = engine.user_stats
+    arrays = [*stats.days.values(), *stats.responses.values()]
+    assert sizeof(stats) > sum(array.nbytes for array in arrays) > 0
+    assert sizeof(engine) - before >= sizeof(stats)
+
+
+def test_append_matches_full_parse():
+    expected = ChatCache(cache_dir=None).load_chat(CHAT)[1]
+    for split in (1, 3, len(RECORDS) // 2, len(RECORDS) - 1):
+        chat_cache = ChatCache(cache_dir=None)
+        key, engine = chat_cache.load_chat("".join(RECORDS[:split]).encode())
+        engine.prepare(("tokens", "emojis", "links"))
+        engine.user_detailed_stats()
+        new_key, appended, added = chat_cache.append_chat(key, CHAT)
+        assert new_key == content_hash(CHAT) and added == len(expected.df) - len(engine.df)
+        pd.testing.assert_frame_equal(appended.df, expected.df)
+        assert_same_analysis(appended, expected)
+
+    with pytest.raises(NotContinuation):
+        chat_cache.append_chat(new_key, TEXT)
+    assert chat_cache.append_chat("0" * 64, CHAT) is None
+
+
+def test_reloaded_chat_matches_parsed(tmp_path):
+    key, engine = ChatCache(cache_dir=str(tmp_path)).load_chat(CHAT)
+    reloaded = ChatCache(cache_dir=str(tmp_path)).get_chat(key)
+    assert reloaded is not engine
+    pd.testing.assert_frame_equal(reloaded.df, engine.df)
+    assert reloaded.df.attrs == engine.df.attrs
+    assert_same_analysis(reloaded, engine)
+
+    # An appended chat is stored under the key of the newer export
+    chat_cache = ChatCache(cache_dir=str(tmp_path))
+    key = chat_cache.load_chat("".join(RECORDS[:5]).encode())[0]
+    new_key, appended, _ = chat_cache.append_chat(key, CHAT)
+    assert_same_analysis(ChatCache(cache_dir=str(tmp_path)).get_chat(new_key), appended)
+
+
+def test_least_recently_used_chat_is_evicted():
+    a, b, c = (AnalysisEngine(preprocessing.preprocess(TEXT.decode())) for _ in range(3))
+    chat_cache = ChatCache(max_bytes=sizeof(a) * 5 // 2, cache_dir=None)
+    chat_cache.put("a", a)
+    chat_cache.put("b", b)
+    assert chat_cache.get("a") is a
+    chat_cache.put("c", c)
+    assert list(chat_cache.entries) == ["a", "c"]
+    assert chat_cache.get("b") is None
+    assert 0 < chat_cache.total_bytes <= chat_cache.max_bytes
+
+    # An entry larger than the whole cache is returned but not kept
+    large = AnalysisEngine(preprocessing.preprocess(TEXT.decode() * 4))
+    assert chat_cache.put("d", large) is large
+    assert list(chat_cache.entries) == ["a", "c"]
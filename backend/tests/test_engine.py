@@ -0,0 +1,51 @@
+import pandas as pd
+import helper
+import preprocessing
+from engine import AnalysisEngine
+
+# Out of time order, with as many messages on Monday and Wednesday, on
+# Sunday and Thursday, and in March and January, so that value_counts()
+# orders the ties by first appearance rather than by the calendar
+TIES = (
+    "01/03/2020, 23:30 - Alice: sunday in march\n"
+    "06/01/2020, 09:00 - Bob: monday\n"
+    "01/01/2020, 10:00 - Alice: wednesday\n"
+    "04/03/2020, 00:15 - Bob: wednesday night\n"
+    "02/03/2020, 13:00 - Alice: monday\n"
+    "02/01/2020, 10:00 - Alice added Bob\n"
+    "oops no date\n"
+)
+
+
+def assert_same_counts(engine_counts, helper_counts):
+    assert list(engine_counts.index) == list(helper_counts.index)
+    assert engine_counts.tolist() == helper_counts.tolist()
+
+
+def test_activity_maps_match_helper():
+    df = preprocessing.preprocess(TIES, date_format="%d/%m/%Y, %H:%M")
+    engine = AnalysisEngine(df)
+    assert list(engine.week_activity_map('Overall').index) == ['Monday', 'Wednesday', 'Sunday', 'Thursday']
+    assert list(engine.month_activity_map('Overall').index) == ['March', 'January']
+    for user in ('Overall', 'Alice', 'Bob', 'group_notification', 'Nobody'):
+        assert_same_counts(engine.week_activity_map(user), helper.week_activity_map(user, df))
+        assert_same_counts(engine.month_activity_map(user), helper.month_activity_map(user, df))
+        heatmap, expected = engine.activity_heatmap(user), helper.activity_heatmap(user, df)
+        assert list(heatmap.index) == list(expected.index)
+        assert list(heatmap.columns) == list(expected.columns)
+        assert heatmap.to_numpy().tolist() == expected.to_numpy().tolist()
+
+
+def test_extended_activity_matches_full_build():
+    lines = TIES.splitlines(keepends=True)
+    for split in range(1, len(lines)):
+        head = preprocessing.preprocess("".join(lines[:split]), date_format="%d/%m/%Y, %H:%M")
+        tail = preprocessing.preprocess("".join(lines[split:]), date_format="%d/%m/%Y, %H:%M")
+        whole = AnalysisEngine(pd.concat([head, tail], ignore_index=True))
+        engine = AnalysisEngine(head)
+        engine.activity()
+        extended = engine.extend(tail)
+        for user in ('Overall', 'Alice', 'Bob'):
+            pd.testing.assert_series_equal(extended.week_activity_map(user), whole.week_activity_map(user))
+            pd.testing.assert_series_equal(extended.month_activity_map(user), whole.month_activity_map(user))
+            pd.testing.assert_frame_equal(extended.activity_heatmap(user), whole.activity_heatmap(user))
@@ -0,0 +1,24 @@
+from wordcloud import WordCloud
+import helper
+
+MESSAGES = [
+    "I'm at the café, it's Bob's turn\n",
+    "cats and a cat, dogs & dogs, glass glasses\n",
+    "Ok ok OK 2 u x 42 times\n",
+    "the party's at 9 -- see you there!!\n",
+    "Dogs dogs DOGS Bob\n",
+]
+
+
+def test_cloud_frequencies_match_wordcloud_unigrams():
+    # The words generate() drew the cloud from before the token index, less
+    # its collocations
+    counts = helper.without_stop_words(helper.token_counts(MESSAGES))
+    text = " ".join(" ".join(word for word in message.lower().split() if word not in helper.STOP_WORDS) for message in MESSAGES)
+    expected = WordCloud(collocations=False).process_text(text)
+    assert dict(helper.cloud_frequencies(counts)) == expected
+
+
+def test_extra_stop_words_extend_configured_set():
+    assert helper.stop_word_set("Foo, bar") == helper.STOP_WORDS | {"foo", "bar"}
+    assert helper.BASE_STOP_WORDS <= helper.STOP_WORDS
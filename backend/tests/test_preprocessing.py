@@ -0,0 +1,54 @@
+import pandas as pd
+import pyarrow as pa
+import preprocessing
+
+# dd/mm only shows in the last message, after many that fit mm/dd as well
+AMBIGUOUS = (
+    "01/02/2020, 10:00 - Alice: hi\n"
+    "03/04/2020, 11:00 - Bob: hello\nsecond line\n"
+    "05/06/2020, 12:00 - Alice added Carol\n"
+) * 40 + "25/06/2020, 13:00 - Carol: a day past the 12th\n"
+
+MIXED = (
+    "[12/31/2020, 10:00:00] Alice: seconds, month first\n"
+    "12/31/20, 10:00 - Bob: short year\n"
+) * 10
+
+
+def test_frames_match_single_pass():
+    for text in (AMBIGUOUS, MIXED, ""):
+        whole = preprocessing.preprocess(text, frame_records=10 ** 6)
+        for frame_records in (1, 7):
+            framed = preprocessing.preprocess(text, frame_records=frame_records)
+            pd.testing.assert_frame_equal(framed, whole)
+            assert framed.attrs == whole.attrs
+
+
+def test_date_format_detected_across_whole_chat():
+    df = preprocessing.preprocess(AMBIGUOUS, frame_records=7)
+    assert df.attrs["date_format"] == "%d/%m/%Y, %H:%M"
+    assert df["date"].iloc[0] == pd.Timestamp("2020-02-01 10:00")
+    assert df["user"].iloc[1] == "Bob" and df["message"].iloc[1] == "hello\nsecond line\n"
+
+
+def test_columns_built_without_python_string_lists():
+    df = preprocessing.preprocess(AMBIGUOUS, frame_records=7)
+    assert df["message"].dtype == pd.ArrowDtype(pa.string())
+    assert pa.array(df["message"]).num_chunks > 1
+    assert df["user"].tolist()[:3] == ["Alice", "Bob", "group_notification"]
+
+
+def test_new_messages_continue_the_parsed_chat():
+    # Repeated messages, told apart by their dates
+    records = [f"{day:02d}/03/2020, 10:00 - Alice: same again\nand again\n" for day in range(1, 29)]
+    records.insert(10, "05/03/2020, 11:00 - Bob added Carol\n")
+    text = "".join(records)
+    whole = preprocessing.preprocess(text)
+    date_format = whole.attrs["date_format"]
+    for split in (1, 2, 11, 20, len(records) - 1, len(records)):
+        head = preprocessing.preprocess("".join(records[:split]), date_format=date_format)
+        tail = preprocessing.find_new_messages(text, head)
+        appended = pd.concat([head, preprocessing.preprocess(tail, date_format=date_format)], ignore_index=True)
+        pd.testing.assert_frame_equal(appended, whole)
+    assert preprocessing.find_new_messages(text, whole) == ""
+    assert preprocessing.find_new_messages(MIXED, whole) is None
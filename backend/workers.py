@@ -0,0 +1,86 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Threads running parsing and analysis, off the event loop. Threads rather
+# than processes, since the parsed chats live in this process's cache.
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", os.cpu_count() or 1))
+
+# Requests allowed to wait for a free worker; any more are turned away
+ANALYSIS_QUEUE_LIMIT = int(os.environ.get("ANALYSIS_QUEUE_LIMIT", 16))
+
+# Seconds a request waits for its result before giving up on it
+ANALYSIS_TIMEOUT_SECONDS = float(os.environ.get("ANALYSIS_TIMEOUT_SECONDS", 120))
+
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def _consume(future):
+    # Results of abandoned work are dropped without asyncio's warning
+    if not future.cancelled():
+        future.exception()
+
+
+class WorkerPool:
+    # Bounded thread pool for blocking work. A task counts against the queue
+    # limit until it has actually finished, so work that kept running after
+    # its request timed out still holds back new requests.
+
+    def __init__(self, workers=ANALYSIS_WORKERS, queue_limit=ANALYSIS_QUEUE_LIMIT, timeout=ANALYSIS_TIMEOUT_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self.limit = workers + queue_limit
+        self.timeout = timeout
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.limit:
+                raise QueueFull()
+            self.pending += 1
+        # The task sees the submitting request's context (its timing trace)
+        future = self.executor.submit(contextvars.copy_context().run, metrics.traced, fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    async def run(self, request, fn, *args):
+        # Runs fn(*args) on the pool. Work that has not started yet is
+        # cancelled when the client disconnects or the timeout passes; work
+        # already running finishes in the background (and fills the caches).
+        future = self.submit(fn, *args)
+        result = asyncio.wrap_future(future)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while True:
+            done, _ = await asyncio.wait({result}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return result.result()
+
+            error = None
+            if request is not None and await request.is_disconnected():
+                error = ClientDisconnected()
+            elif loop.time() >= deadline:
+                error = TimeoutError()
+            if error is not None:
+                future.cancel()
+                result.add_done_callback(_consume)
+                raise error
+
+
+analysis_pool = WorkerPool()
@@ -1,8 +1,8 @@
 "use client";
 
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import { useAuth } from '@/components/auth/AuthContext';
-import { analyzerApi } from '@/lib/api';
+import { analyzerApi, ANALYSIS_SECTIONS } from '@/lib/api';
 import { AnalysisResults } from '@/types';
 import Button from '@/components/ui/Button';
 import FileUpload from '@/components/analyzer/FileUpload';
@@ -22,25 +22,59 @@ import { LogOut, Filter, MessageSquareText } from 'lucide-react';
 export default function AnalyzerPage() {
     const { logout } = useAuth();
     const [isLoading, setIsLoading] = useState(false);
-    const [results, setResults] = useState<AnalysisResults | null>(null);
+    const [results, setResults] = useState<Partial<AnalysisResults> | null>(null);
     const [uploadedFile, setUploadedFile] = useState<File | null>(null);
+    const [chatId, setChatId] = useState<string | null>(null);
     const [selectedUser, setSelectedUser] = useState<string>('Overall');
     const [usersList, setUsersList] = useState<string[]>([]);
 
     const [error, setError] = useState<string | null>(null);
+    const analysisRequest = useRef<AbortController | null>(null);
+
+    // Sections are shown as they stream in, cheapest first; the word cloud
+    // image is fetched alongside them. Starting a new analysis aborts the
+    // previous one, so its late sections cannot overwrite the new results.
+    const loadAnalysis = async (id: string, user: string) => {
+        analysisRequest.current?.abort();
+        const controller = new AbortController();
+        analysisRequest.current = controller;
+
+        if (results?.wordcloud?.startsWith('blob:')) {
+            URL.revokeObjectURL(results.wordcloud);
+        }
+        setResults({});
+        analyzerApi.getWordcloud(id, user, 500, controller.signal)
+            .then((wordcloud) => {
+                if (controller.signal.aborted) {
+                    URL.revokeObjectURL(wordcloud);
+                    return;
+                }
+                setResults((prev) => ({ ...prev, wordcloud }));
+            })
+            .catch(() => undefined);
+        try {
+            await analyzerApi.streamAnalysis(id, user, ANALYSIS_SECTIONS, (section, data) => {
+                setResults((prev) => ({ ...prev, [section]: data }));
+            }, controller.signal);
+        } catch (error) {
+            if (!controller.signal.aborted) {
+                throw error;
+            }
+        }
+    };
 
     const handleAnalyze = async (file: File) => {
         setIsLoading(true);
         setError(null);
         setUploadedFile(file);
         try {
-            const data = await analyzerApi.analyze(file, 'Overall');
-            setResults(data);
-            
-            // Extract users for the dropdown
-            const users = data.busiest_users.percentages.map((u: any) => u.name);
-            setUsersList(['Overall', ...users]);
+            const chat = await analyzerApi.uploadChat(file);
+            setChatId(chat.chat_id);
+
+            // Users for the dropdown ('Overall' first)
+            setUsersList(chat.users);
             setSelectedUser('Overall');
+            await loadAnalysis(chat.chat_id, 'Overall');
         } catch (error: any) {
             console.error('Error analyzing file:', error);
             setError(error.response?.data?.message || 'Failed to analyze chat. Please try again or check the file format.');
@@ -53,11 +87,10 @@ export default function AnalyzerPage() {
         const user = e.target.value;
         setSelectedUser(user);
         
-        if (uploadedFile) {
+        if (chatId) {
             setIsLoading(true);
             try {
-                const data = await analyzerApi.analyze(uploadedFile, user);
-                setResults(data);
+                await loadAnalysis(chatId, user);
             } catch (error) {
                 console.error('Error analyzing for user:', error);
             } finally {
@@ -142,33 +175,35 @@ export default function AnalyzerPage() {
                         </div>
 
                         {/* Components Grid */}
-                        <StatsCards stats={results.stats} />
+                        {results.stats && <StatsCards stats={results.stats} />}
                         
                         <div className="grid grid-cols-1 gap-6 animate-in slide-in-from-bottom-4 duration-700">
-                    <ExtraStats stats={results.extra_stats} />
+                    {results.extra_stats && <ExtraStats stats={results.extra_stats} />}
                     
                     <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
-                        <BusiestUsersChart 
-                            data={results.busiest_users.percentages}
-                        />
-                        <EmojiChart data={results.emojis} />
+                        {results.busiest_users && (
+                            <BusiestUsersChart 
+                                data={results.busiest_users.percentages}
+                            />
+                        )}
+                        {results.emojis && <EmojiChart data={results.emojis} />}
                     </div>
 
-                    <TimelineChart data={results.timeline} />
-                    <DailyTimeline data={results.daily_timeline} />
+                    {results.timeline && <TimelineChart data={results.timeline} />}
+                    {results.daily_timeline && <DailyTimeline data={results.daily_timeline} />}
 
-                    <ActivityMapCharts data={results.activity_map} />
+                    {results.activity_map && <ActivityMapCharts data={results.activity_map} />}
                     
-                    <ActivityHeatmap data={results.activity_heatmap} />
+                    {results.activity_heatmap && <ActivityHeatmap data={results.activity_heatmap} />}
                     
-                    <SentimentChart data={results.sentiment} />
+                    {results.sentiment && <SentimentChart data={results.sentiment} />}
 
                     <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
-                        <WordCloudDisplay imageSrc={results.wordcloud} />
+                        <WordCloudDisplay imageSrc={results.wordcloud ?? ''} />
                         {/* You could put another chart here or leave WordCloud full width if preferred */}
                     </div>
                     
-                    <UserDetailedStatsTable data={results.user_detailed_stats} />
+                    {results.user_detailed_stats && <UserDetailedStatsTable data={results.user_detailed_stats} />}
                 </div>
                     </div>
                 )}
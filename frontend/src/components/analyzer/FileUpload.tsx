@@ -16,8 +16,8 @@ const FileUpload: React.FC<FileUploadProps> = ({ onFileSelect, isLoading = false
         setError('');
         if (acceptedFiles.length > 0) {
             const file = acceptedFiles[0];
-            if (file.type !== 'text/plain' && !file.name.endsWith('.txt')) {
-                setError('Please upload a .txt file exported from WhatsApp');
+            if (!/\.(txt|zip|gz)$/i.test(file.name) && file.type !== 'text/plain') {
+                setError('Please upload the .txt or .zip file exported from WhatsApp');
                 return;
             }
             setSelectedFile(file);
@@ -28,7 +28,9 @@ const FileUpload: React.FC<FileUploadProps> = ({ onFileSelect, isLoading = false
         onDrop, 
         multiple: false,
         accept: {
-            'text/plain': ['.txt']
+            'text/plain': ['.txt'],
+            'application/zip': ['.zip'],
+            'application/gzip': ['.gz']
         }
     });
 
@@ -86,7 +88,7 @@ const FileUpload: React.FC<FileUploadProps> = ({ onFileSelect, isLoading = false
                             {isDragActive ? 'Drop your file here' : 'Upload WhatsApp Chat'}
                         </h3>
                         <p className="text-slate-500 max-w-sm mx-auto text-base">
-                            Drag & drop your exported <code className="bg-slate-100 px-1.5 py-0.5 rounded text-slate-700 font-mono text-sm ml-1">.txt</code> file here, or click to browse
+                            Drag & drop your exported <code className="bg-slate-100 px-1.5 py-0.5 rounded text-slate-700 font-mono text-sm ml-1">.txt</code> or <code className="bg-slate-100 px-1.5 py-0.5 rounded text-slate-700 font-mono text-sm">.zip</code> file here, or click to browse
                         </p>
                     </div>
                 )}
@@ -8,6 +8,10 @@ interface UserStatsProps {
         Words: number;
         Emojis: number;
         Media: number;
+        'First Seen': string;
+        'Last Seen': string;
+        'Active Days': number;
+        'Median Response (min)': number | null;
     }>;
 }
 
@@ -25,7 +29,11 @@ export default function UserDetailedStatsTable({ data }: UserStatsProps) {
                             <th scope="col" className="px-6 py-4">Messages</th>
                             <th scope="col" className="px-6 py-4">Words</th>
                             <th scope="col" className="px-6 py-4">Emojis</th>
-                            <th scope="col" className="px-6 py-4 rounded-r-lg">Media</th>
+                            <th scope="col" className="px-6 py-4">Media</th>
+                            <th scope="col" className="px-6 py-4">First Seen</th>
+                            <th scope="col" className="px-6 py-4">Last Seen</th>
+                            <th scope="col" className="px-6 py-4">Active Days</th>
+                            <th scope="col" className="px-6 py-4 rounded-r-lg">Median Response (min)</th>
                         </tr>
                     </thead>
                     <tbody>
@@ -38,6 +46,10 @@ export default function UserDetailedStatsTable({ data }: UserStatsProps) {
                                 <td className="px-6 py-4">{user.Words}</td>
                                 <td className="px-6 py-4">{user.Emojis}</td>
                                 <td className="px-6 py-4">{user.Media}</td>
+                                <td className="px-6 py-4 whitespace-nowrap">{new Date(user['First Seen']).toLocaleDateString()}</td>
+                                <td className="px-6 py-4 whitespace-nowrap">{new Date(user['Last Seen']).toLocaleDateString()}</td>
+                                <td className="px-6 py-4">{user['Active Days']}</td>
+                                <td className="px-6 py-4">{user['Median Response (min)'] ?? '-'}</td>
                             </tr>
                         ))}
                     </tbody>
@@ -1,5 +1,11 @@
 import axios from 'axios';
-import { AuthResponse, AnalysisResults, User } from '@/types';
+import { AuthResponse, AnalysisResults, ChatUpload, User } from '@/types';
+
+// Everything but the inline base64 word cloud, which is fetched as an image instead
+export const ANALYSIS_SECTIONS = [
+    'stats', 'busiest_users', 'emojis', 'timeline', 'activity_map', 'daily_timeline',
+    'activity_heatmap', 'sentiment', 'user_detailed_stats', 'extra_stats', 'links',
+];
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
@@ -49,10 +55,13 @@ export const authApi = {
 };
 
 export const analyzerApi = {
-    analyze: async (file: File, selectedUser: string = 'Overall'): Promise<AnalysisResults> => {
+    analyze: async (file: File, selectedUser: string = 'Overall', dateFormat?: string | null): Promise<AnalysisResults> => {
         const formData = new FormData();
         formData.append('file', file);
         formData.append('selected_user', selectedUser);
+        if (dateFormat) {
+            formData.append('date_format', dateFormat);
+        }
 
         const response = await api.post<AnalysisResults>('/analyze', formData, {
             headers: {
@@ -60,6 +69,89 @@ export const analyzerApi = {
             },
         });
         return response.data;
+    },
+
+    // Upload once, then request analyses by chat id without re-sending the file
+    uploadChat: async (file: File): Promise<ChatUpload> => {
+        const formData = new FormData();
+        formData.append('file', file);
+
+        const response = await api.post<ChatUpload>('/chats', formData, {
+            headers: {
+                'Content-Type': 'multipart/form-data',
+            },
+        });
+        return response.data;
+    },
+
+    // Newer export of an uploaded chat; only its new messages are parsed
+    appendChat: async (chatId: string, file: File): Promise<ChatUpload & { new_messages: number }> => {
+        const formData = new FormData();
+        formData.append('file', file);
+
+        const response = await api.post<ChatUpload & { new_messages: number }>(`/chats/${chatId}/append`, formData, {
+            headers: {
+                'Content-Type': 'multipart/form-data',
+            },
+        });
+        return response.data;
+    },
+
+    getAnalysis: async (chatId: string, selectedUser: string = 'Overall', sections?: string[]): Promise<AnalysisResults> => {
+        const response = await api.get<AnalysisResults>(`/chats/${chatId}/analysis`, {
+            params: { selected_user: selectedUser, sections: sections?.join(',') },
+        });
+        return response.data;
+    },
+
+    // Streams the analysis as newline delimited JSON and calls onSection with
+    // every section as soon as the server has computed it
+    streamAnalysis: async (
+        chatId: string,
+        selectedUser: string,
+        sections: string[],
+        onSection: (section: string, data: unknown) => void,
+        signal?: AbortSignal,
+    ): Promise<void> => {
+        const token = typeof window !== 'undefined' ? localStorage.getItem('token') : null;
+        const params = new URLSearchParams({ selected_user: selectedUser, sections: sections.join(','), stream: 'ndjson' });
+        const response = await fetch(`${API_URL}/chats/${chatId}/analysis?${params}`, {
+            headers: token ? { Authorization: `Bearer ${token}` } : {},
+            signal,
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`Analysis failed with status ${response.status}`);
+        }
+
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            const lines = buffer.split('\n');
+            buffer = lines.pop() ?? '';
+            for (const line of lines) {
+                if (!line) continue;
+                const { event, data } = JSON.parse(line);
+                if (event === 'error') {
+                    throw new Error(data.detail);
+                }
+                if (event !== 'meta' && event !== 'done') {
+                    onSection(event, data);
+                }
+            }
+        }
+    },
+
+    // Word cloud PNG as an object URL; the browser revalidates it with its ETag
+    getWordcloud: async (chatId: string, selectedUser: string = 'Overall', size: number = 500, signal?: AbortSignal): Promise<string> => {
+        const response = await api.get<Blob>(`/chats/${chatId}/wordcloud.png`, {
+            params: { selected_user: selectedUser, size },
+            responseType: 'blob',
+            signal,
+        });
+        return URL.createObjectURL(response.data);
     }
 };
 
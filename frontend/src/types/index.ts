@@ -67,12 +67,21 @@ export interface SentimentData {
     }[];
 }
 
+export interface WordFrequency {
+    text: string;
+    value: number;
+}
+
 export interface UserDetailedStat {
     User: string;
     Messages: number;
     Words: number;
     Emojis: number;
     Media: number;
+    'First Seen': string;
+    'Last Seen': string;
+    'Active Days': number;
+    'Median Response (min)': number | null;
 }
 
 export interface ExtraStats {
@@ -84,10 +93,17 @@ export interface ExtraStats {
     max_word_count: number;
 }
 
+export interface LinksShared {
+    domains: { domain: string; count: number }[];
+    users: { user: string; count: number }[];
+}
+
 export interface AnalysisResults {
+    date_format: string | null;
     stats: ChatStats;
     busiest_users: BusiestUsers;
-    wordcloud: string; // Base64 string
+    wordcloud: string; // Base64 string or object URL of the PNG
+    wordcloud_words?: WordFrequency[];
     emojis: EmojiData[];
     timeline: TimelineData[];
     daily_timeline: DailyActivity[];
@@ -96,4 +112,12 @@ export interface AnalysisResults {
     sentiment: SentimentData;
     user_detailed_stats: UserDetailedStat[];
     extra_stats: ExtraStats;
+    links: LinksShared;
+    skipped_sections: string[];
+}
+
+export interface ChatUpload {
+    chat_id: string;
+    date_format: string | null;
+    users: string[];
 }